@@ -17,8 +17,72 @@ PORT = 8080
 # 飞书
 FEISHU_APP_ID = os.getenv('FEISHU_APP_ID')
 FEISHU_APP_SECRET = os.getenv('FEISHU_APP_SECRET')
+FEISHU_BATCH_CONCURRENCY = int(os.getenv("FEISHU_BATCH_CONCURRENCY", "3"))  # 批量接口同时发送的请求数
+
+# 本地数据
+DB_PATH = os.getenv("DB_PATH", "data/webpage_collect.db")  # 本地 SQLite 数据库
+MIRROR_SYNC_INTERVAL = int(os.getenv("MIRROR_SYNC_INTERVAL", "300"))  # 飞书表格镜像同步间隔（秒）
+MIRROR_MODIFIED_FIELD = os.getenv("MIRROR_MODIFIED_FIELD", "最后更新时间")  # 增量同步使用的修改时间字段，为空时每次全量扫描
+MIRROR_FULL_SYNC_INTERVAL = int(os.getenv("MIRROR_FULL_SYNC_INTERVAL", "86400"))  # 全量扫描的间隔（秒），用于发现删除的记录
+STATE_URL = os.getenv("STATE_URL")  # 跨进程共享状态，redis://... 或 sqlite:///路径，默认使用 DB_PATH
+
+# 相似文章去重
+NEAR_DUP_ACTION = os.getenv("NEAR_DUP_ACTION", "link")  # link: 不重复保存; reuse_tags: 保存但复用标签; off: 关闭
+NEAR_DUP_DISTANCE = int(os.getenv("NEAR_DUP_DISTANCE", "3"))  # 正文指纹的最大汉明距离
 
 
 # openai
 OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))  # 单次模型调用超时（秒），超过任务执行超时的四分之一时按四分之一计
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))  # 模型调用超时或限流时的重试次数
+PROMPT_MODE = os.getenv("PROMPT_MODE", "compact")  # compact: 压缩文档; full: 完整正文
+COMPACT_PARAGRAPHS = int(os.getenv("COMPACT_PARAGRAPHS", "5"))  # 压缩文档保留的段落数
+COMPACT_KEYWORDS = int(os.getenv("COMPACT_KEYWORDS", "15"))  # 压缩文档附带的关键词数
+COMPACT_TAGS = int(os.getenv("COMPACT_TAGS", "50"))  # 提示词中最多列出的已有标签数
+
+# 任务队列
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))  # 每个进程的任务并发数
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # 最大尝试次数，超过后移入死信表
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))  # 任务执行超时（秒）
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))  # 空闲时轮询队列的间隔（秒）
+JOB_USER_CONCURRENCY = int(os.getenv("JOB_USER_CONCURRENCY", "2"))  # 每个用户同时处理的链接数
+JOB_USER_BACKLOG = int(os.getenv("JOB_USER_BACKLOG", "300"))  # 每个用户最多排队的链接数，超过后拒绝
+
+# 网页抓取
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", "5"))  # 建立连接超时（秒）
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", "15"))  # 读取超时（秒）
+FETCH_TOTAL_TIMEOUT = float(os.getenv("FETCH_TOTAL_TIMEOUT", "30"))  # 单次请求的总超时（秒）
+FETCH_MAX_REDIRECTS = int(os.getenv("FETCH_MAX_REDIRECTS", "5"))  # 最多跟随的重定向次数
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "2"))  # 网络错误、429 和 5xx 的重试次数
+FETCH_HOST_CONCURRENCY = int(os.getenv("FETCH_HOST_CONCURRENCY", "4"))  # 同一域名同时进行的请求数
+FETCH_HOST_INTERVAL = float(os.getenv("FETCH_HOST_INTERVAL", "0.2"))  # 同一域名两次请求的最小间隔（秒）
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", str(10 * 1024 * 1024)))  # 页面大小上限，超出部分截断
+FETCH_DNS_TTL = float(os.getenv("FETCH_DNS_TTL", "300"))  # 域名解析缓存时间（秒），0 表示不缓存
+FETCH_HTTP2 = os.getenv("FETCH_HTTP2", "true").lower() == "true"  # 安装了 httpx[http2] 时使用 HTTP/2
+
+# 网页解析进程池
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "2"))  # 解析网页的子进程数，0 表示在线程中直接解析
+CPU_TASK_TIMEOUT = float(os.getenv("CPU_TASK_TIMEOUT", "30"))  # 单个网页的解析超时（秒）
+CPU_TASK_MEMORY_MB = int(os.getenv("CPU_TASK_MEMORY_MB", "1024"))  # 子进程内存上限（MB）
+CPU_MAX_TASKS_PER_CHILD = int(os.getenv("CPU_MAX_TASKS_PER_CHILD", "100"))  # 子进程处理多少个网页后重启
+
+# 回复合并
+REPLY_WINDOW = float(os.getenv("REPLY_WINDOW", "3"))  # 同一用户的回复合并窗口（秒）
+REPLY_MAX_DELAY = float(os.getenv("REPLY_MAX_DELAY", "60"))  # 批量导入时汇总消息的最长间隔（秒）
+
+# 负载降级，任务积压或模型变慢时依次改用小模型、短提示词、本地标签、暂不打标签
+DEGRADE_DEPTHS = [int(v) for v in os.getenv("DEGRADE_DEPTHS", "30,80,150,300").split(',')]  # 排队任务数达到这些值时依次降一级
+DEGRADE_LATENCIES = [float(v) for v in os.getenv("DEGRADE_LATENCIES", "10,20,40").split(',')]  # 模型平均耗时（秒）达到这些值时依次降一级
+DEGRADE_HOLD = float(os.getenv("DEGRADE_HOLD", "60"))  # 负载回落后每隔多久恢复一级（秒）
+DEGRADED_MODEL = os.getenv("DEGRADED_MODEL", "gpt-4.1-mini")  # 降级时使用的模型
+RETAG_DELAY = float(os.getenv("RETAG_DELAY", "600"))  # 暂不打标签的文章多久后补打标签（秒）
+QUEUE_NOTICE_POSITION = int(os.getenv("QUEUE_NOTICE_POSITION", "5"))  # 前面排队的文章数达到该值时回复排队位置
+
+# 链路追踪
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", "200"))  # 内存中保留的链路数，通过 /admin/traces 查看
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # 同时写入的 JSONL 文件，为空时不写
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")  # cProfile/tracemalloc 采样结果目录
+
+# 管理接口
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # 访问 /admin 接口时通过 X-Admin-Token 请求头传入
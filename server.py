@@ -1,19 +1,69 @@
+import time
+
+# 冷启动计时从导入服务模块开始
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import importlib
+import math
+import traceback
 import uvicorn
 import requests
 import urllib.parse
-from openai import OpenAI
-from bs4 import BeautifulSoup
-from fastapi import FastAPI, Request, HTTPException, Response
+from typing import List
+from fastapi import FastAPI, Request, HTTPException, Response, Query, Header, Depends
 from fastapi.responses import PlainTextResponse
 
 import config
+from utils import ierror
 from utils.crypto import WXBizMsgCrypt
 from utils.xml_parser import parse_xml
 from utils.feishu_table import FeishuTable
-
-access_token = ''
-next_cursor = ''
-feishu_table = FeishuTable('G1rDbcKyNaL1bAso3l8cImdYntX', 'tblpA7YT2FsTls21')
+from utils.record_mirror import RecordMirror
+from utils.search_index import SearchIndex
+from utils.extractor import fetch_page, parse_page
+from utils.fetcher import fetcher
+from utils.cpu_pool import CPUPool
+from utils.tagger import gen_tags, get_client
+from utils.prompt_compactor import KeywordIndex, compact_document, relevant_tags, local_tags
+from utils.shared_state import create_shared_state
+from utils.job_queue import JobQueue, QueueFull, JobPostponed, ClaimLost
+from utils.tag_vocabulary import TagVocabulary
+from utils.near_duplicate import FingerprintIndex
+from utils.pipeline import Pipeline, StopPipeline
+from utils.tracing import tracer, span, traced, current_span
+from utils.llm_usage import get_usage_store, usage_scope
+from utils.reply_aggregator import ReplyAggregator, SAVED, FAILED, DUPLICATE
+from utils.sync_coordinator import SyncCoordinator
+from utils.degradation import (DegradationPolicy, FULL, SHORT_PROMPT, LOCAL_ONLY,
+                               DEFERRED)
+from utils.record_mirror import field_text, field_options
+
+# 令牌、游标等跨进程共享，支持 uvicorn 多 worker 部署
+shared_state = create_shared_state(config.STATE_URL, config.DB_PATH)
+feishu_table = FeishuTable('G1rDbcKyNaL1bAso3l8cImdYntX', 'tblpA7YT2FsTls21',
+                           state=shared_state)
+record_mirror = RecordMirror(config.DB_PATH, feishu_table,
+                             modified_field=config.MIRROR_MODIFIED_FIELD or None,
+                             full_sync_interval=config.MIRROR_FULL_SYNC_INTERVAL)
+search_index = SearchIndex(config.DB_PATH)
+fingerprint_index = FingerprintIndex(config.DB_PATH)
+keyword_index = KeywordIndex(config.DB_PATH)
+job_queue = JobQueue(config.DB_PATH, config.JOB_MAX_ATTEMPTS, config.JOB_VISIBILITY_TIMEOUT,
+                     config.JOB_USER_CONCURRENCY, config.JOB_USER_BACKLOG)
+jobs_available = asyncio.Event()
+cpu_pool = CPUPool(config.CPU_WORKERS, config.CPU_TASK_TIMEOUT, config.CPU_TASK_MEMORY_MB,
+                   config.CPU_MAX_TASKS_PER_CHILD)
+tag_vocabulary = TagVocabulary(feishu_table, 'vewNTuIRsZ', '分类', state=shared_state)
+degradation = DegradationPolicy(config.DEGRADE_DEPTHS, config.DEGRADE_LATENCIES,
+                                hold=config.DEGRADE_HOLD)
+
+# 微信接口复用连接
+http = requests.Session()
+
+# 启动预热状态，全部完成前 /ready 返回 503
+warmup_state = {"ready": False, "steps": {}, "errors": {}}
+IMPORTED_AT = time.perf_counter()
 
 app = FastAPI(title="微信客服回调简化版",
               description="仅包含验证和消息解码功能")
@@ -27,6 +77,298 @@ async def root():
     return "微信客服回调接口已成功部署，请在微信客服管理后台配置 /wechat 作为回调地址"
 
 
+@app.get("/ready")
+async def ready(response: Response):
+    """
+    就绪检查，令牌、连接和标签选项预热完成前返回 503
+    """
+    if not warmup_state["ready"]:
+        response.status_code = 503
+    return warmup_state
+
+
+def require_admin(x_admin_token: str = Header(default='')):
+    """
+    管理接口鉴权，请求头 X-Admin-Token 需与配置的 ADMIN_TOKEN 一致
+    """
+    if not config.ADMIN_TOKEN or x_admin_token != config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="无权访问")
+
+
+def mirror_stats():
+    return {
+        "total": record_mirror.count(),
+        "tags": record_mirror.tag_counts(),
+    }
+
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+async def stats():
+    """
+    已保存文章的统计，直接读取本地镜像
+    """
+    return await asyncio.to_thread(mirror_stats)
+
+
+@app.get("/search", dependencies=[Depends(require_admin)])
+async def search(
+        q: str = '',
+        tag: List[str] = Query(default=[]),
+        limit: int = Query(default=20, le=100),
+        offset: int = 0
+):
+    """
+    搜索已保存的文章，支持按标签筛选，返回标签分面
+    """
+    return await asyncio.to_thread(search_index.search, q, tag, limit, offset)
+
+
+@app.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def admin_jobs(status: str = None, limit: int = 100):
+    """
+    查看任务队列，status 为 dead 时查看死信任务
+    """
+    def load():
+        if status == 'dead':
+            jobs = job_queue.list_dead(limit)
+        else:
+            jobs = job_queue.list_jobs(status, limit)
+        return {"stats": job_queue.stats(), "users": job_queue.user_stats(), "jobs": jobs}
+
+    return await asyncio.to_thread(load)
+
+
+@app.post("/admin/jobs/{job_id}/retry", dependencies=[Depends(require_admin)])
+async def admin_retry_job(job_id: int):
+    """
+    立即重试任务，死信任务会重新入队
+    """
+    if not await asyncio.to_thread(job_queue.retry, job_id):
+        raise HTTPException(status_code=404, detail="任务不存在")
+    jobs_available.set()
+    return {"retried": job_id}
+
+
+@app.get("/admin/metrics", dependencies=[Depends(require_admin)])
+async def admin_metrics():
+    """
+    当前的打标签方式、排队任务数和模型平均耗时
+    """
+    return {
+        "degradation": degradation.snapshot(),
+        "jobs": await asyncio.to_thread(job_queue.stats),
+        "workers": config.JOB_WORKERS,
+        "sync": await asyncio.to_thread(sync_coordinator.status),
+    }
+
+
+@app.get("/admin/llm-usage", dependencies=[Depends(require_admin)])
+async def admin_llm_usage(group_by: str = 'day', days: int = 30):
+    """
+    模型用量汇总，group_by 为 day、open_kfid、model 或 purpose
+    """
+    try:
+        rows = await asyncio.to_thread(get_usage_store().summary, group_by, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"group_by": group_by, "days": days, "rows": rows}
+
+
+@app.get("/admin/traces", dependencies=[Depends(require_admin)])
+async def admin_traces(limit: int = 50, min_ms: float = 0, name: str = None):
+    """
+    最近完成的链路，可按耗时和根 span 名称（job、wechat.callback）筛选
+    只包含当前进程处理的请求
+    """
+    return {"traces": tracer.recent(limit, min_ms, name)}
+
+
+@app.get("/admin/traces/{trace_id}", dependencies=[Depends(require_admin)])
+async def admin_trace(trace_id: str):
+    trace = tracer.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="链路不存在")
+    return trace
+
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile_status():
+    """
+    采样状态和已生成的采样文件
+    """
+    return tracer.profiling_status()
+
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def admin_profile(count: int = 5, memory: bool = False, name: str = 'job'):
+    """
+    对当前进程接下来的 count 条链路采样 cProfile，memory 为 true 时同时记录 tracemalloc
+    结果写入 PROFILE_DIR，可用 python -m pstats 或 snakeviz 查看
+    """
+    tracer.start_profiling(count, memory, name or None)
+    return tracer.profiling_status()
+
+
+def on_mirror_change(records, removed):
+    """
+    镜像同步发现修改或删除时，更新本地索引
+    """
+    search_index.apply_changes(records, removed)
+    if removed:
+        fingerprint_index.remove(removed)
+
+
+async def mirror_sync_loop():
+    """
+    定期扫描飞书表格，同步在飞书界面上的修改
+    """
+    while True:
+        try:
+            # 多进程部署时只有 leader 执行同步
+            if shared_state.is_leader('mirror_sync', config.MIRROR_SYNC_INTERVAL * 2):
+                if search_index.count() == 0:
+                    # 首次启用搜索时，用已有镜像建立索引
+                    await asyncio.to_thread(
+                        search_index.apply_changes, record_mirror.all_records(), [])
+                result = await asyncio.to_thread(
+                    record_mirror.sync, listener=on_mirror_change)
+                print(f"飞书表格镜像同步完成: {result}")
+                await asyncio.to_thread(job_queue.purge_done)
+                await asyncio.to_thread(get_usage_store().purge)
+        except Exception as e:
+            print(f"飞书表格镜像同步失败: {e}")
+        await asyncio.sleep(config.MIRROR_SYNC_INTERVAL)
+
+
+async def tag_flush_loop():
+    """
+    定期批量创建暂存的新标签
+    """
+    while True:
+        await asyncio.sleep(60)
+        try:
+            created = await asyncio.to_thread(tag_vocabulary.flush)
+            if created:
+                print(f"新建分类标签 {created} 个")
+        except Exception as e:
+            print(f"新建分类标签失败: {e}")
+
+
+async def token_refresh_loop():
+    """
+    令牌过期前由 leader 提前刷新，请求路径上不再等待获取令牌
+    """
+    while True:
+        try:
+            if shared_state.is_leader('token_refresh', 120):
+                await asyncio.gather(
+                    asyncio.to_thread(get_access_token),
+                    asyncio.to_thread(feishu_table.get_tenant_access_token),
+                )
+        except Exception as e:
+            print(f"刷新令牌失败: {e}")
+        await asyncio.sleep(60)
+
+
+def _import_modules():
+    # 处理消息和文章时才用到的重量级模块，预热时提前导入
+    for name in ('lxml.etree', 'bs4'):
+        importlib.import_module(name)
+
+
+async def warm_up():
+    """
+    并发获取令牌、建立连接、加载标签选项和导入模块
+    失败的步骤每 5 秒重试一次，全部完成后服务就绪
+    """
+    steps = {
+        'wechat_token': get_access_token,
+        'feishu_token': feishu_table.get_tenant_access_token,
+        'tag_options': tag_vocabulary.load,
+        'openai_client': get_client,
+        'modules': _import_modules,
+        'cpu_pool': cpu_pool.warm_up,
+    }
+
+    async def run_step(name, func):
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            warmup_state["errors"][name] = str(e)
+            return False
+        warmup_state["steps"][name] = round(time.perf_counter() - start, 3)
+        warmup_state["errors"].pop(name, None)
+        return True
+
+    start = time.perf_counter()
+    pending = dict(steps)
+    while True:
+        results = await asyncio.gather(*(run_step(n, f) for n, f in pending.items()))
+        pending = {n: f for (n, f), ok in zip(pending.items(), results) if not ok}
+        if not pending:
+            break
+        print(f"启动预热失败，5 秒后重试: {warmup_state['errors']}")
+        await asyncio.sleep(5)
+
+    warmup_state["import_seconds"] = round(IMPORTED_AT - STARTED_AT, 3)
+    warmup_state["warmup_seconds"] = round(time.perf_counter() - start, 3)
+    warmup_state["cold_start_seconds"] = round(time.perf_counter() - STARTED_AT, 3)
+    warmup_state["ready"] = True
+    print(f"冷启动完成，共 {warmup_state['cold_start_seconds']}s："
+          f"导入 {warmup_state['import_seconds']}s，预热 {warmup_state['warmup_seconds']}s "
+          f"{warmup_state['steps']}")
+
+
+async def reply_flush_loop():
+    """
+    定期发送合并后的回复
+    """
+    while True:
+        await asyncio.sleep(0.5)
+        try:
+            await asyncio.to_thread(reply_aggregator.flush)
+        except Exception as e:
+            print(f"发送合并回复失败: {e}")
+
+
+async def degradation_loop():
+    """
+    定期按排队的链接数调整打标签方式
+    """
+    while True:
+        try:
+            depth = await asyncio.to_thread(job_queue.depth, 'link')
+            degradation.update(depth)
+        except Exception as e:
+            print(f"更新打标签方式失败: {e}")
+        await asyncio.sleep(2)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    asyncio.create_task(warm_up())
+    asyncio.create_task(degradation_loop())
+    asyncio.create_task(reply_flush_loop())
+    asyncio.create_task(mirror_sync_loop())
+    asyncio.create_task(token_refresh_loop())
+    asyncio.create_task(tag_flush_loop())
+    for _ in range(config.JOB_WORKERS):
+        asyncio.create_task(job_worker())
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    # 停止服务前发出还在合并窗口内的回复
+    await asyncio.to_thread(reply_aggregator.flush, True)
+    try:
+        await asyncio.to_thread(tag_vocabulary.flush)
+    except Exception as e:
+        print(f"新建分类标签失败: {e}")
+    await asyncio.to_thread(cpu_pool.shutdown)
+    await asyncio.to_thread(fetcher.close)
+
+
 @app.get("/wechat", response_class=PlainTextResponse)
 async def wechat_get(
         msg_signature: str,
@@ -69,43 +411,64 @@ async def wechat_get(
 
 
 def get_access_token(force=False):
-    global access_token
+    access_token = shared_state.get('wechat_access_token')
+    if access_token and not force:
+        return access_token
 
-    if not access_token or force:
-        res = requests.get(
+    with shared_state.lock('wechat_access_token'):
+        # 等锁期间其他进程可能已经刷新
+        current = shared_state.get('wechat_access_token')
+        if current and (not force or current != access_token):
+            return current
+
+        res = http.get(
             f'https://qyapi.weixin.qq.com/cgi-bin/gettoken'
             f'?corpid={config.WECHAT_APP_ID}&corpsecret={config.WECHAT_SECRET}'
         )
-        access_token = res.json().get('access_token')
+        result = res.json()
+        access_token = result.get('access_token')
+        if access_token:
+            shared_state.set('wechat_access_token', access_token,
+                             ttl=max(result.get('expires_in', 7200) - 300, 60))
 
     return access_token
 
 
+# access_token 无效、缺失或过期
+WECHAT_TOKEN_ERRCODES = {40014, 41001, 42001}
+
+
 def _request(url, data):
     _access_token = get_access_token()
-    res = requests.post(url + _access_token, json=data)
-    if res.json()['errcode'] == 0:
-        return res.json()
-
-    print('error request: ', res.json())
+    result = http.post(url + _access_token, json=data).json()
+    if result.get('errcode') not in WECHAT_TOKEN_ERRCODES:
+        if result.get('errcode'):
+            print('error request: ', result)
+        return result
+
+    # 只在令牌失效时刷新重试，其他错误刷新令牌也没有用
+    print('access_token 失效，刷新后重试: ', result)
     _access_token = get_access_token(force=True)
-    res = requests.post(url + _access_token, json=data)
-    return res.json()
+    return http.post(url + _access_token, json=data).json()
 
 
-def get_message(params, next_cursor):
+@traced()
+def get_message(open_kfid, token, next_cursor):
     url = 'https://qyapi.weixin.qq.com/cgi-bin/kf/sync_msg?access_token='
 
     data = {
-        "token": params['Token'],
-        "open_kfid": params['OpenKfId'],
+        "open_kfid": open_kfid,
     }
+    if token:
+        data['token'] = token
     if next_cursor:
         data['cursor'] = next_cursor
 
     return _request(url, data)
 
 
+# 回复由 reply_flush_loop 定期合并发送，不单独开始链路
+@traced(root=False)
 def send_text_message(openid, user_id, msgid, content):
     data = {
         "touser": user_id,
@@ -124,54 +487,333 @@ def send_text_message(openid, user_id, msgid, content):
     )
 
 
-def gen_tags(url, tags):
-    res = requests.get(url, headers={
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/75.0.3770.100 Safari/537.36'
-        }
-    )
+reply_aggregator = ReplyAggregator(send_text_message, config.REPLY_WINDOW, config.REPLY_MAX_DELAY)
 
-    soup = BeautifulSoup(res.text, 'html.parser')
-    body = soup.find('body')
-
-    prompt = '''
-    # 角色
-    你是一个高效的分类标签生成助手，能精准分析文本内容，为其生成合适的分类标签，方便在文章库中进行过滤。若文章介绍了某个软件或者工具，会将该软件/工具名称也作为一个标签。
-
-    ## 技能
-    ### 技能 1: 生成分类标签
-    1. 仔细分析用户提供的文本内容。
-    2. 根据内容主题、关键信息等，生成不超过4个分类标签，每个标签不超过4个字。
-    3. 若文本介绍了软件或工具，将该软件/工具名称也作为一个标签。
-    4. 用英文逗号分隔标签进行输出。
-
-    ## 限制:
-    - 只专注于生成文本分类标签相关内容，拒绝回答无关话题。
-    - 输出的标签必须符合要求，不超过规定数量和字数。
-    - 输出格式必须是英文逗号分隔的标签形式。
-    - 只需输出标签，不要包含其他内容。
-    - 如果在已有标签中有相近的，就使用已有标签。
-    
-    ## 已有标签:
-    {}
-
-    具体内容如下：\n\n
-    {}
-    '''.format('\n'.join(f'- {o}' for o in tags),
-               body.text.replace('\n\n\n', '\n').strip())
-
-    client = OpenAI(
-        base_url=config.OPENAI_API_BASE,
-        api_key=config.OPENAI_API_KEY
-    )
 
-    response = client.responses.create(
-        model="gpt-4.1",
-        input=prompt
-    )
-    return response.output_text.split(',')
+def tag_document(doc, options, mode, tag_limit=config.COMPACT_TAGS):
+    """
+    调用模型为文档打标签，并记录耗时供降级策略使用
+    :param mode: 打标签方式，full 使用默认模型，其余使用 DEGRADED_MODEL
+    """
+    model = "gpt-4.1" if mode == FULL else config.DEGRADED_MODEL
+    start = time.perf_counter()
+    try:
+        tags = gen_tags(doc, relevant_tags(doc, options, tag_limit) if tag_limit else options, model)
+    except Exception:
+        degradation.record_failure()
+        raise
+    degradation.record_latency(time.perf_counter() - start)
+    return tags
+
+
+def tag_article(article, title, desc, options, mode):
+    """
+    按打标签方式生成标签
+    负载越高使用的模型越小、提示词越短，本地标签方式不调用模型，暂不打标签方式返回空列表
+    """
+    if mode == DEFERRED:
+        return []
+    if mode in (SHORT_PROMPT, LOCAL_ONLY):
+        doc = compact_document(article, title, desc,
+                               keyword_index.top_keywords(article['text'], 8), 1, 500)
+        if mode == LOCAL_ONLY:
+            return local_tags(doc, options)
+        return tag_document(doc, options, mode, config.COMPACT_TAGS // 2)
+    if config.PROMPT_MODE == 'compact':
+        # 只把压缩后的文档和相关标签交给模型，减少输入 token
+        doc = compact_document(
+            article, title, desc,
+            keyword_index.top_keywords(article['text'], config.COMPACT_KEYWORDS),
+            config.COMPACT_PARAGRAPHS
+        )
+        return tag_document(doc, options, mode)
+    return tag_document(article['text'], options, mode, 0)
+
+
+def handle_messages(open_kfid, msg_list):
+    """
+    处理拉取到的一页消息：链接写入任务队列，其他消息回复提示
+    在同步线程中执行，返回后才提交游标
+    """
+    # 每个用户本次最后一个链接的任务ID，用于回复排队位置
+    last_jobs = {}
+    for message in msg_list:
+        # 只处理微信客户发送的消息
+        if message.get('origin') != 3:
+            continue
+        user = (message['open_kfid'], message['external_userid'])
+        if message['msgtype'] != 'link':
+            # 连续发送的非链接消息只提示一次
+            reply_aggregator.notice(*user, '目前我只能处理链接消息')
+            continue
+        try:
+            # 按用户公平调度，批量转发不影响其他用户
+            job_id = job_queue.enqueue('link', message, dedup_key=message['msgid'],
+                                       user_key=f"{user[0]}:{user[1]}")
+            if job_id:
+                last_jobs[user] = job_id
+        except QueueFull as e:
+            print(f"拒绝链接消息: {e}")
+            reply_aggregator.notice(*user, '待处理的链接太多了，请等前面的文章保存完再发送')
+
+    for user, job_id in last_jobs.items():
+        position = job_queue.position(job_id)
+        if position < config.QUEUE_NOTICE_POSITION:
+            continue
+        content = f"前面还有 {position} 篇文章在排队"
+        wait = degradation.estimate_wait(position, config.JOB_WORKERS)
+        if wait:
+            content += f"，预计 {math.ceil(wait / 60)} 分钟后开始保存"
+        reply_aggregator.notice(*user, content)
+
+
+def on_synced(open_kfid, count):
+    if count:
+        jobs_available.set()
+
+
+# 每个客服账号一个同步循环，同一账号的回调合并，不同账号并行
+sync_coordinator = SyncCoordinator(get_message, handle_messages, shared_state, on_synced)
+
+
+async def process_link(message, first_attempt=True, heartbeat=None):
+    """
+    保存一篇链接消息对应的文章
+    确认消息、读取标签选项和抓取网页互不依赖，按依赖关系并发执行
+    回复交给 reply_aggregator，同一用户连续转发的链接合并回复
+    :param first_attempt: 重试时不再发送开始保存的消息
+    :param heartbeat: 每个步骤开始前调用，延长任务的可见性超时，可选
+    """
+    url = message['link']['url']
+    title = message['link']['title']
+    user = (message['open_kfid'], message['external_userid'])
+
+    def check_saved(results):
+        if record_mirror.find_by_url(url):
+            reply_aggregator.finished(*user, message['msgid'], title, DUPLICATE)
+            raise StopPipeline()
+
+    def ack(results):
+        reply_aggregator.started(*user, message['msgid'], title,
+                                 message['msgid'], ack=first_attempt)
+
+    def load_options(results):
+        return tag_vocabulary.names()
+
+    def fetch(results):
+        return fetch_page(url)
+
+    def extract(results):
+        # 解析网页是 CPU 密集的纯 Python 计算，放到子进程中执行
+        with span('parse'):
+            article = parse_page(*results['fetch'], cpu_pool.run)
+        fingerprint = article.pop('fingerprint')
+
+        # 同一篇文章以不同链接转载时，按正文指纹识别
+        duplicate = None
+        if fingerprint is not None and config.NEAR_DUP_ACTION != 'off':
+            found = fingerprint_index.find(fingerprint, config.NEAR_DUP_DISTANCE)
+            duplicate = record_mirror.get_record(found[0]) if found else None
+
+        if duplicate and config.NEAR_DUP_ACTION == 'link':
+            fields = duplicate['fields']
+            reply_aggregator.finished(
+                *user, message['msgid'], title, DUPLICATE,
+                f"这篇文章与已保存的《{field_text(fields.get('标题'))}》内容相同，未重复保存\n"
+                f"{field_text(fields.get('链接'))}"
+            )
+            raise StopPipeline()
+        return article, fingerprint, duplicate
+
+    def tag(results):
+        article, _, duplicate = results['extract']
+        if duplicate:
+            # 复用已有记录的标签，不再调用模型
+            return field_options(duplicate['fields'].get('分类')), None
+
+        # 积压较多或模型变慢时改用更便宜的方式
+        mode = degradation.take()
+        current_span().set(tag_mode=mode)
+        # 新标签在写入记录前批量创建，见 tag_vocabulary.writing
+        tags = tag_vocabulary.resolve(tag_article(article, message['link']['title'],
+                                                  message['link']['desc'],
+                                                  results['options'], mode))
+        return tags, mode
+
+    def save(results):
+        article, fingerprint, _ = results['extract']
+        tags, mode = results['tag']
+        doc = None
+        if mode == DEFERRED:
+            # 先保存，负载回落后再补打标签，不用重新抓取网页
+            doc = compact_document(
+                article, message['link']['title'], message['link']['desc'],
+                keyword_index.top_keywords(article['text'], config.COMPACT_KEYWORDS),
+                config.COMPACT_PARAGRAPHS
+            )
+        with span('create_record'), tag_vocabulary.writing(tags):
+            result = feishu_table.create_record(
+                {
+                    '标题': message['link']['title'],
+                    '分类': tags,
+                    '链接': {
+                        'text': url,
+                        'link': url,
+                    },
+                    '描述': message['link']['desc'],
+                    '图片链接': message['link']['pic_url'],
+                }
+            )
+        record = result.get('record', {})
+        if doc is not None and record.get('record_id'):
+            try:
+                # 内部任务不属于任何用户，不受 JOB_USER_BACKLOG 限制
+                job_queue.enqueue('retag', {'record_id': record['record_id'], 'doc': doc,
+                                            'open_kfid': message['open_kfid']},
+                                  dedup_key=f"retag:{record['record_id']}",
+                                  delay=config.RETAG_DELAY)
+            except Exception:
+                # 没有补打标签任务的记录会一直没有标签，删除后由重试重新保存
+                feishu_table.delete_record(record['record_id'])
+                raise
+        record_mirror.upsert_record(record)
+        if record.get('record_id'):
+            search_index.add_article(
+                record['record_id'],
+                url,
+                message['link']['title'],
+                message['link']['desc'],
+                tags,
+                article['text']
+            )
+            if fingerprint is not None:
+                fingerprint_index.add(record['record_id'], fingerprint)
+            keyword_index.add_document(article['text'])
+
+    def done(results):
+        reply_aggregator.finished(*user, message['msgid'], title, SAVED)
+
+    # 成功回复依赖确认消息，保证用户收到的顺序不变
+    pipeline = Pipeline(f"保存文章 {url}", heartbeat and (lambda stage: heartbeat()))
+    pipeline.add('check', check_saved)
+    pipeline.add('ack', ack, ('check',))
+    pipeline.add('options', load_options)
+    pipeline.add('fetch', fetch, ('check',))
+    pipeline.add('extract', extract, ('fetch',))
+    pipeline.add('tag', tag, ('extract', 'options'))
+    pipeline.add('save', save, ('tag',))
+    pipeline.add('done', done, ('save', 'ack'))
+    try:
+        # 模型用量按客服账号归属
+        with usage_scope(purpose='link', open_kfid=message['open_kfid']):
+            await pipeline.run()
+    finally:
+        print(pipeline.report())
+
+
+def retag_record(payload, heartbeat=None):
+    """
+    为降级时未打标签的记录补打标签
+    :param heartbeat: 写回记录前调用，延长任务的可见性超时，可选
+    """
+    mode = degradation.mode
+    if mode in (LOCAL_ONLY, DEFERRED):
+        raise JobPostponed(config.RETAG_DELAY, f"当前打标签方式为 {mode}")
+
+    with usage_scope(purpose='retag', open_kfid=payload.get('open_kfid', '')):
+        tags = tag_vocabulary.resolve(
+            tag_document(payload['doc'], tag_vocabulary.names(), mode))
+    if heartbeat is not None:
+        heartbeat()
+    with tag_vocabulary.writing(tags):
+        feishu_table.update_record(payload['record_id'], {'分类': tags})
+
+    record = record_mirror.get_record(payload['record_id'])
+    if record is not None:
+        record['fields']['分类'] = tags
+        record_mirror.upsert_record(record)
+        search_index.apply_changes([record], [])
+
+
+async def process_job(job):
+    def heartbeat():
+        # 任务执行超过可见性超时已被重新领取时抛出 ClaimLost，不再写回结果
+        job_queue.extend(job['id'], job['claim_token'])
+
+    with span('job', kind=job['kind'], job_id=job['id'], attempt=job['attempts']) as job_span:
+        if job['kind'] == 'link':
+            job_span.set(url=job['payload']['link']['url'])
+            await process_link(job['payload'], job['attempts'] == 1, heartbeat)
+        elif job['kind'] == 'retag':
+            job_span.set(record_id=job['payload']['record_id'])
+            await asyncio.to_thread(retag_record, job['payload'], heartbeat)
+        else:
+            raise Exception(f"未知的任务类型: {job['kind']}")
+
+
+def notify_job_failed(job, error, retrying=False):
+    """
+    任务失败时更新用户的回复，最终失败时计入汇总
+    """
+    message = job['payload']
+    if job['kind'] != 'link':
+        return
+    user = (message['open_kfid'], message['external_userid'])
+    if retrying:
+        reply_aggregator.abandon(*user, message['msgid'])
+    else:
+        reply_aggregator.finished(*user, message['msgid'], message['link']['title'],
+                                  FAILED, error)
+
+
+async def job_worker():
+    """
+    从持久化队列领取任务并执行，失败的任务按退避策略重试
+    """
+    while True:
+        try:
+            # 执行超时且不再重试的任务同样通知用户
+            job = await asyncio.to_thread(job_queue.claim, notify_job_failed)
+        except Exception as e:
+            print(f"领取任务失败: {e}")
+            job = None
+
+        if job is None:
+            try:
+                await asyncio.wait_for(jobs_available.wait(), config.JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            jobs_available.clear()
+            continue
+
+        try:
+            start = time.perf_counter()
+            await process_job(job)
+            await asyncio.to_thread(job_queue.complete, job['id'], job['claim_token'])
+            if job['kind'] == 'link':
+                degradation.record_job(time.perf_counter() - start)
+        except ClaimLost as e:
+            # 已由其他 worker 重新执行，本次的结果和失败都不再处理
+            print(f"任务 {job['id']} 执行超时，放弃本次执行: {e}")
+        except JobPostponed as e:
+            print(f"任务 {job['id']} 推迟 {e.delay} 秒执行: {e}")
+            try:
+                await asyncio.to_thread(job_queue.postpone, job['id'], job['claim_token'], e.delay)
+            except Exception as e:
+                print(f"更新任务状态失败: {e}")
+        except Exception as e:
+            traceback.print_exc()
+            print(f"任务 {job['id']} 第 {job['attempts']} 次执行失败: {e}")
+            try:
+                retrying = await asyncio.to_thread(job_queue.fail, job['id'],
+                                                   job['claim_token'], str(e))
+                notify_job_failed(job, str(e), retrying)
+            except Exception as e:
+                print(f"更新任务状态失败: {e}")
 
 
 @app.post("/wechat")
+@traced('wechat.callback')
 async def wechat_post(
         request: Request,
         msg_signature: str = None,
@@ -187,21 +829,6 @@ async def wechat_post(
 
         # 获取请求体
         body = await request.body()
-        xml_content = body.decode("utf-8")
-        message_dict = parse_xml(xml_content)
-
-        # 如果直接解析成功，并且有消息类型，则使用直接解析结果
-        if message_dict and "MsgType" in message_dict:
-            print("使用直接解析结果")
-            print(f'解析结果: {message_dict}')
-            return Response(content="success", media_type="text/plain")
-
-        # 否则尝试解密处理
-        # print("尝试解密处理消息")
-        # 检查必要参数
-        if not all([msg_signature, timestamp, nonce]):
-            print("缺少必要的加密参数，无法解密")
-            return Response(content="success", media_type="text/plain")
 
         # 初始化WXBizMsgCrypt
         wxcpt = WXBizMsgCrypt(
@@ -210,66 +837,37 @@ async def wechat_post(
             config.WECHAT_APP_ID
         )
 
-        # 解密消息
-        ret, decrypted_content = wxcpt.DecryptMsg(
-            xml_content, msg_signature, timestamp, nonce)
+        # 直接在请求体字节上提取密文、校验签名并解密，不再重复解析XML
+        with span('decrypt'):
+            ret, decrypted_content, _ = wxcpt.DecryptEnvelope(
+                body, msg_signature, timestamp, nonce)
+        if ret == ierror.WXBizMsgCrypt_ParseXml_Error:
+            # 没有密文时按明文消息解析
+            message_dict = parse_xml(body)
+            if message_dict and "MsgType" in message_dict:
+                print("使用直接解析结果")
+                print(f'解析结果: {message_dict}')
+            return Response(content="success", media_type="text/plain")
         if ret != 0:
             print(f"消息解密失败，错误码: {ret}")
             return Response(content="success", media_type="text/plain")
 
         # 解析解密后的XML
-        message_dict = parse_xml(decrypted_content.decode('utf-8'))
+        message_dict = parse_xml(decrypted_content)
         # print(f"解密后解析结果: {message_dict}")
 
-        global next_cursor
-        messages = get_message(message_dict, next_cursor)
-        next_cursor = messages.get('next_cursor', '')
-
-        if not messages['msg_list']:
-            return Response(content="success", media_type="text/plain")
-
-        # print(f'原始消息：{messages}')
-        message = messages['msg_list'][-1]
-        if message['msgtype'] != 'link':
-            send_text_message(
-                message['open_kfid'],
-                message['external_userid'],
-                message['msgid'],
-                '目前我只能处理链接消息'
-            )
-            # 返回success
-            return Response(content="success", media_type="text/plain")
-
-        send_text_message(
-            message['open_kfid'],
-            message['external_userid'],
-            message['msgid'],
-            '开始保存文章，请稍等...'
-        )
-
-        field = feishu_table.get_field('vewNTuIRsZ', '分类')
-        options = [o["name"] for o in field["property"]["options"]]
-        tags = gen_tags(message['link']['url'], options)
-        feishu_table.create_record(
-            {
-                '标题': message['link']['title'],
-                '分类': tags,
-                '链接': {
-                    'text': message['link']['url'],
-                    'link': message['link']['url'],
-                },
-                '描述': message['link']['desc'],
-                '图片链接': message['link']['pic_url'],
-            }
-        )
-        send_text_message(message['open_kfid'], message['external_userid'], '', '文章保存成功！')
+        # 拉取消息交给该客服账号的同步循环，回调立即返回
+        open_kfid = message_dict.get('OpenKfId') if message_dict else None
+        if open_kfid:
+            sync_coordinator.notify(open_kfid, message_dict.get('Token', ''))
 
     except Exception as e:
-        import traceback
         traceback.print_exc()
         print(f"处理消息异常: {e}")
         return Response(content="success", media_type="text/plain")
 
+    return Response(content="success", media_type="text/plain")
+
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
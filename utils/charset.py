@@ -0,0 +1,157 @@
+import codecs
+import re
+import threading
+from collections import OrderedDict
+
+# 只在开头这么多字节中查找 <meta charset>
+META_SCAN_BYTES = 4096
+# 统计检测只使用这么多字节的样本
+DETECT_SAMPLE_BYTES = 32 * 1024
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+_HEADER_CHARSET = re.compile(r'charset\s*=\s*["\']?([\w.:-]+)', re.I)
+_NON_ASCII = re.compile(rb'[\x80-\xff]')
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+
+# GBK 和 GB2312 都是 GB18030 的子集，统一按 GB18030 解码，兼容页面中的扩展字符
+_ALIASES = {
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+    'x-gbk': 'gb18030',
+    'cp936': 'gb18030',
+    'gb_2312-80': 'gb18030',
+    'big5': 'big5hkscs',
+}
+
+_host_cache: 'OrderedDict[str, str]' = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 1024
+
+
+def normalize_charset(name: str) -> str:
+    """
+    规范化编码名称，无法识别的编码返回空字符串
+    """
+    try:
+        name = codecs.lookup(name.strip().lower()).name
+    except (LookupError, AttributeError):
+        return ''
+    return _ALIASES.get(name, name)
+
+
+def cached_charset(host: str) -> str:
+    """
+    域名上次统计检测出的编码，没有时返回空字符串
+    """
+    with _cache_lock:
+        charset = _host_cache.get(host, '')
+        if charset:
+            _host_cache.move_to_end(host)
+        return charset
+
+
+def remember_charset(host: str, charset: str):
+    """
+    记录域名统计检测出的编码
+    """
+    with _cache_lock:
+        _host_cache[host] = charset
+        _host_cache.move_to_end(host)
+        while len(_host_cache) > _CACHE_SIZE:
+            _host_cache.popitem(last=False)
+
+
+def _sample(content: bytes) -> bytes:
+    """
+    从第一个非 ASCII 字节开始取样本，跳过开头的内联脚本和样式
+    开头的纯 ASCII 内容按任何编码都能解码，不能用来判断编码
+    :return: 全文都是 ASCII 时返回空字节串
+    """
+    match = _NON_ASCII.search(content)
+    return content[match.start():match.start() + DETECT_SAMPLE_BYTES] if match else b''
+
+
+def _is_utf8(sample: bytes) -> bool:
+    try:
+        # 样本末尾可能截断在多字节字符中间，不按完整输入解码
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _detect(sample: bytes) -> str:
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return 'gb18030'
+    best = from_bytes(sample).best()
+    return (normalize_charset(best.encoding) if best else '') or 'gb18030'
+
+
+def declared_charset(content: bytes, content_type: str = '') -> str:
+    """
+    不做统计检测能确定的编码，依次检查 BOM、响应头、开头的 <meta charset>，
+    都没有时从第一个非 ASCII 字节开始的样本能按 UTF-8 解码则为 UTF-8
+    :return: 编码名称，无法确定时返回空字符串
+    """
+    for bom, charset in _BOMS:
+        if content.startswith(bom):
+            return charset
+
+    match = _HEADER_CHARSET.search(content_type or '')
+    charset = normalize_charset(match.group(1)) if match else ''
+    if charset:
+        return charset
+
+    match = _META_CHARSET.search(content, 0, META_SCAN_BYTES)
+    charset = normalize_charset(match.group(1).decode('ascii', 'ignore')) if match else ''
+    if charset:
+        return charset
+
+    # 大多数页面是 UTF-8，含非 ASCII 字符的样本能按 UTF-8 解码就不再做统计检测；
+    # 全文都是 ASCII 时按 UTF-8 解码结果相同
+    sample = _sample(content)
+    if not sample or _is_utf8(sample):
+        return 'utf-8'
+    return ''
+
+
+def guess_charset(content: bytes) -> str:
+    """
+    对从第一个非 ASCII 字节开始的有限长度样本做统计检测
+    """
+    return _detect(_sample(content) or content[:DETECT_SAMPLE_BYTES])
+
+
+def detect_charset(content: bytes, content_type: str = '', host: str = '') -> str:
+    """
+    判断网页编码，没有声明编码时做统计检测，检测结果按域名缓存在当前进程
+    :param content: 响应内容
+    :param content_type: Content-Type 响应头
+    :param host: 域名，用于缓存检测结果
+    :return: 编码名称
+    """
+    charset = declared_charset(content, content_type)
+    if charset:
+        return charset
+
+    charset = cached_charset(host) if host else ''
+    if not charset:
+        charset = guess_charset(content)
+        if host:
+            remember_charset(host, charset)
+    return charset
+
+
+def decode_html(content: bytes, content_type: str = '', host: str = '') -> str:
+    """
+    将响应内容解码为文本，无法解码的字节替换为占位符
+    """
+    return content.decode(detect_charset(content, content_type, host), errors='replace')
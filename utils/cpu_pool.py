@@ -0,0 +1,125 @@
+import multiprocessing
+import resource
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+
+class TaskTimeout(Exception):
+    """
+    任务执行超时
+    """
+
+
+def _init_worker(memory_limit: int):
+    # 限制子进程的地址空间，超出时任务抛出 MemoryError，不影响主进程
+    if memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    # Ctrl+C 由主进程处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _on_alarm(signum, frame):
+    raise TaskTimeout('任务执行超时')
+
+
+def _run_task(func: Callable, args: tuple, timeout: float):
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _noop():
+    return None
+
+
+class CPUPool:
+    """
+    CPU 密集任务的进程池
+    解析网页等纯 Python 计算放到子进程执行，不占用服务进程的 GIL；
+    每个任务有超时和内存上限，子进程执行一定数量的任务后重启，避免内存持续增长
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 30, memory_limit_mb: int = 1024,
+                 max_tasks_per_child: int = 100):
+        """
+        :param workers: 子进程数，为 0 时在调用线程中直接执行
+        :param timeout: 单个任务的超时（秒）
+        :param memory_limit_mb: 子进程的内存上限（MB），为 0 时不限制
+        :param max_tasks_per_child: 子进程执行多少个任务后重启
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor = None
+        self._lock = threading.Lock()
+        # 排队的任务数有上限，调用方在这里等待，而不是堆积在进程池的队列中
+        self._slots = threading.BoundedSemaphore(max(workers, 1) * 2)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.memory_limit,),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        # 卡住的子进程收不到取消信号，直接结束
+        for process in list((executor._processes or {}).values()):
+            process.kill()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    def run(self, func: Callable, *args) -> Any:
+        """
+        在子进程中执行函数并等待结果，在线程中调用，不要在事件循环中直接调用
+        :param func: 模块级函数，参数和返回值需要可以 pickle，尽量传字节、返回精简的结果
+        :return: 函数的返回值
+        :raises TaskTimeout: 执行超时
+        :raises MemoryError: 超出内存上限
+        """
+        if self.workers <= 0:
+            return func(*args)
+
+        with self._slots:
+            executor = self._get_executor()
+            future = executor.submit(_run_task, func, args, self.timeout)
+            try:
+                # 子进程内的定时器先触发；卡在 C 扩展中时由这里兜底
+                return future.result(timeout=self.timeout * 2 + 5)
+            except FutureTimeout:
+                self._reset(executor)
+                raise TaskTimeout(f"任务执行超过 {self.timeout} 秒，已重启进程池")
+            except BrokenProcessPool:
+                self._reset(executor)
+                raise Exception('处理进程异常退出，已重启进程池')
+
+    def warm_up(self):
+        """
+        提前启动子进程
+        """
+        if self.workers <= 0:
+            return
+        executor = self._get_executor()
+        for future in [executor.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            # wait=False 时管理线程可能在进程表清空后补充子进程而报错
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,144 @@
+import threading
+import time
+from typing import Dict, List, Optional
+
+# 打标签方式，按成本从高到低排列
+FULL = 'full'
+SMALL_MODEL = 'small_model'
+SHORT_PROMPT = 'short_prompt'
+LOCAL_ONLY = 'local_only'
+DEFERRED = 'deferred'
+MODES = [FULL, SMALL_MODEL, SHORT_PROMPT, LOCAL_ONLY, DEFERRED]
+
+
+class DegradationPolicy:
+    """
+    按任务积压数量和模型耗时选择打标签的方式
+    负载升高时立即降级；负载回落后每隔 hold 秒恢复一级，避免在两种方式之间来回切换。
+    降到不调用模型的方式后没有新的耗时样本，超过 hold 秒没有样本时不再按耗时降级，
+    恢复调用模型后重新统计
+    """
+
+    def __init__(self, depth_thresholds: List[float], latency_thresholds: List[float],
+                 alpha: float = 0.3, hold: float = 60):
+        """
+        :param depth_thresholds: 降到第 1、2、3、4 级的排队任务数
+        :param latency_thresholds: 降到第 1、2、3 级的模型平均耗时（秒）
+        :param alpha: 耗时指数移动平均的权重
+        :param hold: 恢复一级前负载需要持续低于阈值的时间（秒）
+        """
+        self.depth_thresholds = depth_thresholds
+        self.latency_thresholds = latency_thresholds
+        self.alpha = alpha
+        self.hold = hold
+        self._lock = threading.Lock()
+        self._level = 0
+        self._changed_at = time.time()
+        self._below_since: Optional[float] = None
+        self._latency: Optional[float] = None
+        self._latency_at = 0
+        self._job_seconds: Optional[float] = None
+        self._depth = 0
+        self._counts = {mode: 0 for mode in MODES}
+
+    @staticmethod
+    def _level_for(value: Optional[float], thresholds: List[float]) -> int:
+        if value is None:
+            return 0
+        return sum(value >= t for t in thresholds)
+
+    def record_latency(self, seconds: float):
+        """
+        记录一次模型调用的耗时
+        """
+        with self._lock:
+            if self._latency is None:
+                self._latency = seconds
+            else:
+                self._latency = self.alpha * seconds + (1 - self.alpha) * self._latency
+            self._latency_at = time.time()
+
+    def record_failure(self):
+        """
+        模型调用失败按最慢的情况计入
+        """
+        if self.latency_thresholds:
+            self.record_latency(self.latency_thresholds[-1])
+
+    def record_job(self, seconds: float):
+        """
+        记录一个任务的处理耗时，用于估算排队等待时间
+        """
+        with self._lock:
+            if self._job_seconds is None:
+                self._job_seconds = seconds
+            else:
+                self._job_seconds = self.alpha * seconds + (1 - self.alpha) * self._job_seconds
+
+    def update(self, depth: int) -> str:
+        """
+        按当前排队任务数重新选择打标签的方式
+        :param depth: 等待执行的任务数
+        :return: 当前方式
+        """
+        now = time.time()
+        with self._lock:
+            self._depth = depth
+            latency = self._latency
+            if latency is not None and now - self._latency_at >= self.hold:
+                latency = self._latency = None
+            target = max(self._level_for(depth, self.depth_thresholds),
+                         self._level_for(latency, self.latency_thresholds))
+            target = min(target, len(MODES) - 1)
+
+            if target > self._level:
+                self._set_level(target, now, depth, latency)
+            elif target < self._level:
+                if self._below_since is None:
+                    self._below_since = now
+                elif now - self._below_since >= self.hold:
+                    self._set_level(self._level - 1, now, depth, latency)
+            else:
+                self._below_since = None
+            return MODES[self._level]
+
+    def _set_level(self, level: int, now: float, depth: int, latency: Optional[float]):
+        print(f"打标签方式 {MODES[self._level]} -> {MODES[level]}，"
+              f"排队 {depth} 个，模型平均耗时 {'-' if latency is None else f'{latency:.1f}s'}")
+        self._level = level
+        self._changed_at = now
+        self._below_since = None
+
+    def take(self) -> str:
+        """
+        为一个任务取当前的打标签方式，并计数
+        """
+        with self._lock:
+            mode = MODES[self._level]
+            self._counts[mode] += 1
+            return mode
+
+    @property
+    def mode(self) -> str:
+        return MODES[self._level]
+
+    def estimate_wait(self, position: int, workers: int) -> Optional[float]:
+        """
+        估算排在 position 位的任务开始执行前的等待时间（秒）
+        """
+        if self._job_seconds is None:
+            return None
+        return position * self._job_seconds / max(workers, 1)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'mode': MODES[self._level],
+                'since': self._changed_at,
+                'depth': self._depth,
+                'llm_latency': round(self._latency, 2) if self._latency is not None else None,
+                'job_seconds': round(self._job_seconds, 2) if self._job_seconds is not None else None,
+                'depth_thresholds': self.depth_thresholds,
+                'latency_thresholds': self.latency_thresholds,
+                'jobs_by_mode': dict(self._counts),
+            }
@@ -0,0 +1,256 @@
+import re
+import urllib.parse
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from utils.charset import (decode_html, declared_charset, guess_charset, cached_charset,
+                           remember_charset)
+from utils.fetcher import fetcher
+
+# 站点专用的提取函数和请求头，按域名注册
+_EXTRACTORS: Dict[str, Callable[[str], Optional[Dict]]] = {}
+_USER_AGENTS: Dict[str, str] = {}
+
+
+def register_extractor(*hosts: str, user_agent: str = None):
+    """
+    注册站点专用的提取函数
+    提取函数返回 None 时（如文章已删除、页面结构变化）回退到通用提取
+    :param hosts: 域名
+    :param user_agent: 抓取该站点时使用的 User-Agent，可选
+    """
+    def decorator(func):
+        for host in hosts:
+            _EXTRACTORS[host] = func
+            if user_agent:
+                _USER_AGENTS[host] = user_agent
+        return func
+    return decorator
+
+
+def _host(url: str) -> str:
+    return (urllib.parse.urlsplit(url).hostname or '').lower() if url else ''
+
+
+def fetch_page(url: str) -> Tuple[bytes, str, str]:
+    """
+    抓取网页的原始内容，解码和解析交给 parse_page
+    短链接跳转到公众号等站点时，按重定向后的链接选择提取函数和缓存的编码
+    :param url: 网页链接
+    :return: (响应内容, Content-Type, 重定向后的链接)
+    """
+    user_agent = _USER_AGENTS.get(_host(url))
+    return fetcher.get(url, {'User-Agent': user_agent} if user_agent else None)
+
+
+def fetch_html(url: str) -> str:
+    """
+    抓取网页内容
+    :param url: 网页链接
+    :return: HTML文本
+    """
+    content, content_type, final_url = fetch_page(url)
+    # 不使用 res.text，避免没有声明编码时对整个页面做统计检测
+    return decode_html(content, content_type, _host(final_url))
+
+
+def extract_article(html: str, url: str = None) -> Dict:
+    """
+    提取网页的标题、小标题、段落和正文
+    :param html: HTML文本
+    :param url: 网页链接，有站点专用提取函数时优先使用
+    :return: 包含 title、headings、paragraphs、text 的字典
+    """
+    extractor = _EXTRACTORS.get(_host(url))
+    if extractor is not None:
+        try:
+            article = extractor(html)
+        except Exception as e:
+            print(f"站点提取失败，使用通用提取: {e}")
+            article = None
+        if article is not None:
+            return article
+    return extract_generic(html)
+
+
+def extract_generic(html: str) -> Dict:
+    """
+    通用提取：解析整个页面，取 body 的文本
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for node in soup(['script', 'style', 'noscript', 'template']):
+        node.decompose()
+
+    title = soup.title.get_text(strip=True) if soup.title else ''
+    body = soup.find('body') or soup
+    text = body.get_text().replace('\n\n\n', '\n').strip()
+
+    headings = [h.get_text(' ', strip=True) for h in body.find_all(['h1', 'h2', 'h3'])]
+    paragraphs = [p.get_text(' ', strip=True) for p in body.find_all('p')]
+    paragraphs = [p for p in paragraphs if p]
+    if not paragraphs:
+        paragraphs = [line.strip() for line in text.split('\n') if len(line.strip()) >= 20]
+
+    return {
+        'title': title,
+        'headings': [h for h in headings if h],
+        'paragraphs': paragraphs,
+        'text': text,
+    }
+
+
+WECHAT_USER_AGENT = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_5 like Mac OS X) AppleWebKit/605.1.15 '
+                     '(KHTML, like Gecko) Mobile/15E148 MicroMessenger/8.0.50(0x1800323c) '
+                     'NetType/WIFI Language/zh_CN')
+
+_WECHAT_META = re.compile(
+    r'<meta\s+(?:property|name)="(og:title|og:article:author|author)"\s+content="([^"]*)"', re.I)
+# 以字面量开头，正则引擎可以直接查找 "var"，开头加 \b 时会在几百 KB 的脚本中逐字符尝试
+_WECHAT_CREATE_TIME = re.compile(r'var\s+(?:ct|create_time)\s*=\s*"?(\d{10})"?')
+_WECHAT_CONTENT = re.compile(r'<div[^>]*\bid="js_content"')
+# 正文之后是大段脚本和推荐内容，遇到这些标记就停止
+_WECHAT_CONTENT_END = re.compile(r'<script\b|id="js_pc_qr_code"|class="rich_media_tool')
+
+
+@register_extractor('mp.weixin.qq.com', user_agent=WECHAT_USER_AGENT)
+def extract_wechat_article(html: str) -> Optional[Dict]:
+    """
+    提取微信公众号文章
+    只解析标题到正文结束的片段，跳过页面中大段的内联脚本和模板
+    :return: 在通用字段之外还包含 author、publish_time，找不到正文时返回 None
+    """
+    from lxml import html as lxml_html
+
+    start = _WECHAT_CONTENT.search(html)
+    if start is None:
+        return None
+    end = _WECHAT_CONTENT_END.search(html, start.end())
+    head_start = html.find('id="activity-name"', 0, start.start())
+    head_start = html.rfind('<', 0, head_start) if head_start >= 0 else start.start()
+    fragment = html[head_start:end.start() if end else len(html)]
+
+    meta = {}
+    for name, value in _WECHAT_META.findall(html, 0, head_start):
+        meta.setdefault(name.lower(), value)
+
+    root = lxml_html.fromstring(fragment)
+    content = root.xpath('//*[@id="js_content"]')
+    if not content:
+        return None
+    content = content[0]
+
+    title = ''.join(root.xpath('//*[@id="activity-name"]//text()')).strip() \
+        or meta.get('og:title', '')
+    author = ''.join(root.xpath('//*[@id="js_name"]//text()')).strip() \
+        or meta.get('og:article:author') or meta.get('author', '')
+
+    publish_time = ''
+    match = _WECHAT_CREATE_TIME.search(html, end.start() if end else 0)
+    if match:
+        publish_time = datetime.fromtimestamp(int(match.group(1))).strftime('%Y-%m-%d %H:%M:%S')
+
+    # 块级元素后补换行，正文按段落分行
+    for node in content.iter('p', 'section', 'div', 'br', 'li', 'blockquote', 'pre',
+                             'h1', 'h2', 'h3', 'h4'):
+        node.tail = '\n' + (node.tail or '')
+
+    headings = [h.text_content().strip() for h in content.xpath('.//h1|.//h2|.//h3')]
+    paragraphs = [' '.join(p.text_content().split()) for p in content.xpath('.//p')]
+    paragraphs = [p for p in paragraphs if p]
+    text = '\n'.join(line.strip() for line in content.text_content().splitlines() if line.strip())
+    if not paragraphs:
+        paragraphs = [line for line in text.split('\n') if len(line) >= 20]
+
+    return {
+        'title': title,
+        'author': author,
+        'publish_time': publish_time,
+        'headings': [h for h in headings if h],
+        'paragraphs': paragraphs,
+        'text': text,
+    }
+
+
+def extract_page(content: bytes, content_type: str, url: str, charset_hint: str = '') -> Dict:
+    """
+    解码、提取正文并计算正文指纹，供 CPUPool 在子进程中执行
+    只返回后续步骤需要的文本字段，减少进程间传输
+    :param charset_hint: 页面没有声明编码时使用的编码，通常是该域名上次检测出的编码
+    :return: extract_article 的结果，另含 fingerprint，正文过短时为 None；
+             charset 为本次统计检测出的编码，没有检测时为空字符串
+    """
+    from utils.near_duplicate import simhash, MIN_TEXT_CHARS
+
+    charset = declared_charset(content, content_type)
+    detected = ''
+    if not charset:
+        charset = charset_hint or guess_charset(content)
+        detected = '' if charset_hint else charset
+    article = extract_article(content.decode(charset, errors='replace'), url)
+    text = article['text']
+    article['fingerprint'] = simhash(text) if len(text) >= MIN_TEXT_CHARS else None
+    article['charset'] = detected
+    return article
+
+
+def parse_page(content: bytes, content_type: str, url: str,
+               run: Callable[..., Dict] = None) -> Dict:
+    """
+    解析网页，按域名缓存的编码保存在调用进程中
+    子进程每执行一定数量的任务就会重启，缓存放在子进程里几乎命中不了
+    :param url: 重定向后的链接，用于选择站点专用提取函数和编码缓存
+    :param run: 执行 extract_page 的函数，如 CPUPool.run，默认在当前线程执行
+    :return: extract_page 的结果，不含 charset
+    """
+    host = _host(url)
+    hint = cached_charset(host) if host else ''
+    if run is None:
+        article = extract_page(content, content_type, url, hint)
+    else:
+        article = run(extract_page, content, content_type, url, hint)
+    detected = article.pop('charset', '')
+    if detected and host:
+        remember_charset(host, detected)
+    return article
+
+
+def extract_text(html: str) -> str:
+    """
+    提取网页正文文本
+    :param html: HTML文本
+    :return: 去除多余空行后的正文
+    """
+    return extract_article(html)['text']
+
+
+# 对比站点专用提取和通用提取的耗时和正文长度
+# python -m utils.extractor 保存的页面.html|链接 ...
+# 保存的页面按公众号文章解析，如 python -m utils.extractor tests/fixtures/wechat_article.html
+if __name__ == '__main__':
+    import os
+    import sys
+    import time
+
+    def bench(func, html, number=20):
+        start = time.perf_counter()
+        for _ in range(number):
+            result = func(html)
+        return (time.perf_counter() - start) / number, result
+
+    for source in sys.argv[1:]:
+        if os.path.exists(source):
+            with open(source, encoding='utf-8') as f:
+                page = f.read()
+            url = 'https://mp.weixin.qq.com/s/fixture'
+        else:
+            url = source
+            page = fetch_html(url)
+
+        generic_time, generic = bench(extract_generic, page)
+        site_time, site = bench(lambda h: extract_article(h, url), page)
+        print(f"{source} ({len(page) // 1024} KB)"
+              f"\n  通用: {generic_time * 1000:.1f} ms，正文 {len(generic['text'])} 字"
+              f"\n  专用: {site_time * 1000:.1f} ms，正文 {len(site['text'])} 字，"
+              f"标题《{site['title']}》 作者 {site.get('author', '')} {site.get('publish_time', '')}")
@@ -1,44 +1,98 @@
+import json
+import time
 import requests
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Callable, Tuple
 import config
 
+# 批量接口每次请求的记录数，批量写入和删除的上限为 500，批量获取为 100
+BATCH_WRITE_SIZE = 500
+BATCH_GET_SIZE = 100
+# 写冲突、限流时整块重试的次数
+BATCH_RETRIES = 3
+_RETRY_CODES = {1254290, 1254291}
+# 某条记录的内容有误（记录或字段不存在、字段值转换失败），只有这些错误需要二分定位
+_RECORD_ERROR_CODES = {1254043, 1254045, *range(1254060, 1254075)}
+# 令牌缺失、无效或过期
+_TOKEN_ERROR_CODES = {99991661, 99991663, 99991668, 99991677}
+
 
 class FeishuTable:
     """
     飞书多维表格操作类
     """
-    def __init__(self, app_token: str, table_id: str, app_id: str = None, app_secret: str = None):
+    def __init__(self, app_token: str, table_id: str, app_id: str = None, app_secret: str = None,
+                 state=None):
         """
         初始化飞书多维表格操作类
         :param app_id: 飞书应用ID，如果为None则使用config中的配置
         :param app_secret: 飞书应用密钥，如果为None则使用config中的配置
+        :param state: SharedState 实例，多进程部署时用于共享租户访问令牌，可选
         """
         self.app_id = app_id or config.FEISHU_APP_ID
         self.app_secret = app_secret or config.FEISHU_APP_SECRET
         self.base_url = "https://open.feishu.cn/open-apis"
         self._tenant_access_token = None
+        self._token_expire = 7200
         self.app_token = app_token
         self.table_id = table_id
+        self.state = state
+        # 复用连接，避免每次请求重新建立 TLS 连接
+        self.session = requests.Session()
+
+    @property
+    def _token_key(self) -> str:
+        return f"feishu_tenant_access_token:{self.app_id}"
 
     def get_tenant_access_token(self) -> str:
         """
         获取租户访问令牌
+        配置了共享状态时，多个进程共用一个令牌，只有一个进程负责刷新
         :return: 租户访问令牌
         """
-        if self._tenant_access_token:
-            return self._tenant_access_token
+        if self.state is None:
+            if self._tenant_access_token:
+                return self._tenant_access_token
+            return self._fetch_tenant_access_token()
+
+        # 每次都读共享状态，其他进程刷新后立即生效
+        token = self.state.get(self._token_key)
+        if token:
+            self._tenant_access_token = token
+            return token
+
+        with self.state.lock(self._token_key):
+            # 等锁期间其他进程可能已经刷新
+            token = self.state.get(self._token_key)
+            if not token:
+                token = self._fetch_tenant_access_token()
+                self.state.set(self._token_key, token,
+                               ttl=max(self._token_expire - 300, 60))
+            self._tenant_access_token = token
+            return token
+
+    def invalidate_tenant_access_token(self):
+        """
+        令牌失效时清除本地和共享的缓存
+        """
+        if self.state is not None and self._tenant_access_token:
+            if self.state.get(self._token_key) == self._tenant_access_token:
+                self.state.delete(self._token_key)
+        self._tenant_access_token = None
 
+    def _fetch_tenant_access_token(self) -> str:
         url = f"{self.base_url}/auth/v3/tenant_access_token/internal"
         payload = {
             "app_id": self.app_id,
             "app_secret": self.app_secret
         }
 
-        response = requests.post(url, json=payload)
+        response = self.session.post(url, json=payload)
         result = response.json()
 
         if result.get("code") == 0:
             self._tenant_access_token = result.get("tenant_access_token")
+            self._token_expire = result.get("expire", 7200)
             return self._tenant_access_token
         else:
             raise Exception(f"获取租户访问令牌失败: {result}")
@@ -61,13 +115,14 @@ class FeishuTable:
             'params': params,
         }
 
-        response = requests.request(**payload, headers=self.get_headers())
+        response = self.session.request(**payload, headers=self.get_headers())
         result = response.json()
-        if result.get("code") == 0:
+        # 只在令牌失效时刷新重试；记录内容出错时批量接口会逐块重试，不能每次都刷新令牌
+        if result.get("code") not in _TOKEN_ERROR_CODES:
             return result
 
-        self._tenant_access_token = None
-        response = requests.request(**payload, headers=self.get_headers())
+        self.invalidate_tenant_access_token()
+        response = self.session.request(**payload, headers=self.get_headers())
         return response.json()
 
     def get_app_info(self) -> Dict:
@@ -190,12 +245,16 @@ class FeishuTable:
         )
 
     def get_records(self, view_id: str = None, page_size: int = 100,
-                    page_token: str = None) -> Dict:
+                    page_token: str = None, field_names: List[str] = None,
+                    filter: str = None, automatic_fields: bool = False) -> Dict:
         """
         获取记录列表
         :param view_id: 视图ID，可选
         :param page_size: 每页记录数，最大为 100
         :param page_token: 分页标记，首次调用不填
+        :param field_names: 只返回指定字段，可选
+        :param filter: 筛选公式，如 CurrentValue.[标题]="xxx"，可选
+        :param automatic_fields: 是否返回创建时间、修改时间等自动字段
         :return: 记录列表信息
         """
         url = f"{self.base_url}/bitable/v1/apps/{self.app_token}/tables/{self.table_id}/records"
@@ -207,12 +266,68 @@ class FeishuTable:
         if page_token:
             params["page_token"] = page_token
 
+        if field_names:
+            params["field_names"] = json.dumps(field_names, ensure_ascii=False)
+
+        if filter:
+            params["filter"] = filter
+
+        if automatic_fields:
+            params["automatic_fields"] = "true"
+
         result = self._request('get', url, params=params)
         if result.get("code") == 0:
             return result.get("data", {})
         else:
             raise Exception(f"获取记录列表失败: {result}")
 
+    def iter_pages(self, view_id: str = None, page_size: int = 100,
+                   page_token: str = None, field_names: List[str] = None,
+                   filter: str = None, automatic_fields: bool = False,
+                   prefetch: bool = True) -> Iterator[Dict]:
+        """
+        逐页遍历全部记录，调用方处理当前页时在后台预取下一页
+        内存中最多同时持有两页数据，适合几十万行的大表
+        :param page_token: 起始分页标记，用于从断点继续
+        :param prefetch: 是否预取下一页
+        :return: 每页数据，包含 items、page_token、has_more
+        """
+        def fetch(token):
+            return self.get_records(view_id, page_size, token, field_names,
+                                    filter, automatic_fields)
+
+        executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            page = fetch(page_token)
+            while True:
+                next_token = page.get("page_token") if page.get("has_more") else None
+                future = executor.submit(fetch, next_token) if executor and next_token else None
+                yield page
+                if not next_token:
+                    break
+                page = future.result() if future else fetch(next_token)
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def iter_records(self, view_id: str = None, page_size: int = 100,
+                     field_names: List[str] = None, filter: str = None,
+                     automatic_fields: bool = False,
+                     prefetch: bool = True) -> Iterator[Dict]:
+        """
+        逐条遍历全部记录，自动处理分页
+        :param view_id: 视图ID，可选
+        :param page_size: 每页记录数，最大为 100
+        :param field_names: 只返回指定字段，可选
+        :param filter: 筛选公式，可选
+        :param automatic_fields: 是否返回自动字段
+        :param prefetch: 是否预取下一页
+        :return: 记录迭代器
+        """
+        for page in self.iter_pages(view_id, page_size, None, field_names,
+                                    filter, automatic_fields, prefetch):
+            yield from page.get("items") or []
+
     def create_record(self, fields: Dict[str, Any]) -> Dict:
         """
         创建记录
@@ -230,23 +345,135 @@ class FeishuTable:
         else:
             raise Exception(f"创建记录失败: {result}")
 
-    def batch_create_records(self, records: List[Dict[str, Any]]) -> Dict:
+    def _send_chunk(self, url: str, payload: Dict) -> Dict:
+        # 并发写同一张表时可能返回写冲突或限流，网络也可能临时出错，稍后重试整块，而不是按失败拆分
+        for attempt in range(BATCH_RETRIES + 1):
+            try:
+                result = self._request('post', url, payload)
+            except requests.RequestException:
+                if attempt == BATCH_RETRIES:
+                    raise
+            else:
+                if result.get("code") not in _RETRY_CODES or attempt == BATCH_RETRIES:
+                    return result
+            time.sleep(0.5 * 2 ** attempt)
+
+    def _run_chunk(self, url: str, start: int, chunk: List, build: Callable[[List], Dict],
+                   name: str) -> Tuple[List[Tuple[int, Dict]], List[Dict]]:
         """
-        批量创建记录
-        :param records: 记录列表，每个记录是一个字典，key为字段名或ID，value为字段值
-        :return: 创建的记录信息
+        发送一块记录，因记录内容出错时二分重试，直到定位到出错的单条记录
+        :return: ([(起始下标, data)], [错误])
         """
-        url = f"{self.base_url}/bitable/v1/apps/{self.app_token}/tables/{self.table_id}/records/batch_create"
-        records_data = [{"fields": record} for record in records]
-        payload = {
-            "records": records_data
-        }
+        try:
+            result = self._send_chunk(url, build(chunk))
+        except Exception as e:
+            # 网络错误与记录内容无关，不再拆分
+            return [], [{"index": start + i, "record": item, "error": f"{name}失败: {e}"}
+                        for i, item in enumerate(chunk)]
 
-        result = self._request('post', url, payload)
         if result.get("code") == 0:
-            return result.get("data", {})
+            return [(start, result.get("data", {}))], []
+        if len(chunk) == 1 or result.get("code") not in _RECORD_ERROR_CODES:
+            # 鉴权、权限、重试后仍然限流等错误拆分后同样失败，整块记为失败
+            return [], [{"index": start + i, "record": item, "error": f"{name}失败: {result}"}
+                        for i, item in enumerate(chunk)]
+
+        middle = len(chunk) // 2
+        left_data, left_errors = self._run_chunk(url, start, chunk[:middle], build, name)
+        right_data, right_errors = self._run_chunk(url, start + middle, chunk[middle:], build, name)
+        return left_data + right_data, left_errors + right_errors
+
+    def _batch(self, path: str, items: List, size: int, build: Callable[[List], Dict],
+               name: str, max_workers: int = None) -> Dict:
+        """
+        按接口上限分块，并发调用批量接口并合并结果
+        某一块失败时只有出错的记录进入 errors，其余记录照常处理
+        :param path: 接口路径，如 records/batch_create
+        :param items: 全部记录
+        :param size: 每块的记录数
+        :param build: 将一块记录转换为请求体
+        :param name: 操作名称，用于错误信息
+        :param max_workers: 同时发送的块数，默认使用 config.FEISHU_BATCH_CONCURRENCY
+        :return: data 中的列表字段按输入顺序合并（跳过失败的记录），另含 errors: [{index, record, error}]
+        """
+        url = f"{self.base_url}/bitable/v1/apps/{self.app_token}/tables/{self.table_id}/{path}"
+        chunks = [(i, items[i:i + size]) for i in range(0, len(items), size)]
+        workers = min(max_workers or config.FEISHU_BATCH_CONCURRENCY, len(chunks))
+
+        if workers <= 1:
+            outcomes = [self._run_chunk(url, start, chunk, build, name) for start, chunk in chunks]
         else:
-            raise Exception(f"批量创建记录失败: {result}")
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                outcomes = list(executor.map(
+                    lambda c: self._run_chunk(url, c[0], c[1], build, name), chunks))
+
+        merged: Dict[str, Any] = {"records": []}
+        errors = []
+        for data_list, chunk_errors in outcomes:
+            errors.extend(chunk_errors)
+            for _, data in sorted(data_list, key=lambda d: d[0]):
+                for key, value in data.items():
+                    if isinstance(value, list):
+                        merged.setdefault(key, []).extend(value)
+        if errors:
+            print(f"{name}: {len(items)} 条中 {len(errors)} 条失败，首个错误: {errors[0]['error']}")
+        merged["errors"] = errors
+        return merged
+
+    def batch_create_records(self, records: List[Dict[str, Any]], max_workers: int = None) -> Dict:
+        """
+        批量创建记录，超过接口上限时自动分块并发创建
+        :param records: 记录列表，每个记录是一个字典，key为字段名或ID，value为字段值
+        :param max_workers: 同时发送的块数，可选
+        :return: records 为创建成功的记录，errors 为失败的记录及原因
+        """
+        return self._batch(
+            'records/batch_create', records, BATCH_WRITE_SIZE,
+            lambda chunk: {"records": [{"fields": record} for record in chunk]},
+            '批量创建记录', max_workers
+        )
+
+    def batch_update_records(self, records: List[Dict[str, Any]], max_workers: int = None) -> Dict:
+        """
+        批量更新记录，超过接口上限时自动分块并发更新
+        :param records: 记录列表，每个记录包含 record_id 和 fields
+        :param max_workers: 同时发送的块数，可选
+        :return: records 为更新后的记录，errors 为失败的记录及原因
+        """
+        return self._batch(
+            'records/batch_update', records, BATCH_WRITE_SIZE,
+            lambda chunk: {"records": [{"record_id": r["record_id"], "fields": r["fields"]}
+                                       for r in chunk]},
+            '批量更新记录', max_workers
+        )
+
+    def batch_delete_records(self, record_ids: List[str], max_workers: int = None) -> Dict:
+        """
+        批量删除记录，超过接口上限时自动分块并发删除
+        :param record_ids: 记录ID列表
+        :param max_workers: 同时发送的块数，可选
+        :return: records 为 [{record_id, deleted}]，errors 为失败的记录及原因
+        """
+        return self._batch(
+            'records/batch_delete', record_ids, BATCH_WRITE_SIZE,
+            lambda chunk: {"records": chunk},
+            '批量删除记录', max_workers
+        )
+
+    def batch_get_records(self, record_ids: List[str], automatic_fields: bool = False,
+                          max_workers: int = None) -> Dict:
+        """
+        按记录ID批量获取记录，超过接口上限时自动分块并发获取
+        :param record_ids: 记录ID列表
+        :param automatic_fields: 是否返回创建时间、修改时间等自动字段
+        :param max_workers: 同时发送的块数，可选
+        :return: records 为记录列表，absent_record_ids 为不存在的记录ID，errors 为失败的记录及原因
+        """
+        return self._batch(
+            'records/batch_get', record_ids, BATCH_GET_SIZE,
+            lambda chunk: {"record_ids": chunk, "automatic_fields": automatic_fields},
+            '批量获取记录', max_workers
+        )
 
     def update_record(self, record_id: str, fields: Dict[str, Any]) -> Dict:
         """
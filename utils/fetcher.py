@@ -0,0 +1,561 @@
+import ipaddress
+import math
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import config
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+              '(KHTML, like Gecko) Chrome/130.0.0.0 Safari/537.36')
+DEFAULT_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+}
+
+# 限流和服务端临时错误，稍后重试
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Retry-After 最多等待的时间（秒）
+MAX_RETRY_AFTER = 30
+
+
+class FetchError(Exception):
+    """
+    抓取失败，status 为 HTTP 状态码，网络错误时为 None
+    """
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class _DNSCache:
+    """
+    域名解析结果缓存，只用于抓取文章的连接，不影响进程中的其他请求
+    """
+
+    def __init__(self, ttl: float, size: int = 1024):
+        """
+        :param ttl: 缓存时间（秒），为 0 时不缓存
+        :param size: 最多缓存的域名数
+        """
+        self.ttl = ttl
+        self.size = size
+        self._cache: 'OrderedDict[tuple, Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> str:
+        """
+        :return: 解析出的第一个地址，不缓存或 host 已经是 IP 时原样返回
+        """
+        if self.ttl <= 0 or _is_ip(host):
+            return host
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit and hit[0] > now:
+                self._cache.move_to_end(key)
+                return hit[1]
+        # 解析失败不缓存，下次重新解析
+        address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._cache[key] = (now + self.ttl, address)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return address
+
+    def forget(self, host: str):
+        """
+        连接失败时清除缓存，下次重新解析，避免一直连接已经失效的地址
+        """
+        with self._lock:
+            for key in [k for k in self._cache if k[0] == host]:
+                del self._cache[key]
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return True
+    except ValueError:
+        return False
+
+
+def _cached_dns_connection(base, dns: _DNSCache):
+    """
+    连接时使用缓存的解析结果，TLS 的 SNI 和证书校验仍然使用原来的域名
+    """
+    class Connection(base):
+        def _new_conn(self):
+            # urllib3 只在建立 TCP 连接时使用 _dns_host，host 属性也由它得到，连接后立即恢复
+            host = self._dns_host
+            self._dns_host = dns.resolve(host, self.port)
+            try:
+                return super()._new_conn()
+            except Exception:
+                dns.forget(host)
+                raise
+            finally:
+                self._dns_host = host
+
+    return Connection
+
+
+class _CachedDNSAdapter(HTTPAdapter):
+    """
+    域名解析使用 _DNSCache 的连接池适配器
+    """
+
+    def __init__(self, dns: _DNSCache, **kwargs):
+        # 父类的 __init__ 会调用 init_poolmanager
+        self.dns = dns
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('HTTPConnectionPool', (HTTPConnectionPool,), {
+                'ConnectionCls': _cached_dns_connection(HTTPConnection, self.dns)}),
+            'https': type('HTTPSConnectionPool', (HTTPSConnectionPool,), {
+                'ConnectionCls': _cached_dns_connection(HTTPSConnection, self.dns)}),
+        }
+
+
+class _Watchdog:
+    """
+    到达总超时后关闭连接，服务器每次只返回几个字节时读取也不会超过总超时
+    """
+
+    def __init__(self, deadline: float, sock):
+        self.sock = sock
+        self.fired = False
+        self.timer = threading.Timer(max(deadline - time.monotonic(), 0), self._fire)
+        self.timer.daemon = True
+
+    def _fire(self):
+        self.fired = True
+        try:
+            # shutdown 能中断其他线程中阻塞的 recv，close 不能
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        if self.sock is not None:
+            self.timer.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.cancel()
+
+
+class _HostLimiter:
+    """
+    单个域名的并发数和请求间隔限制
+    """
+
+    def __init__(self, concurrency: int, interval: float):
+        self.slots = threading.BoundedSemaphore(max(concurrency, 1))
+        self.interval = interval
+        self.next_at = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.slots.acquire()
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def __exit__(self, *exc):
+        self.slots.release()
+
+
+class _RequestsBackend:
+    """
+    每个域名一个 Session，连接在同一域名的文章之间复用
+    """
+    transient = (requests.ConnectionError, requests.Timeout,
+                 requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, per_host: int, max_redirects: int, dns: _DNSCache, max_hosts: int = 256):
+        self.per_host = per_host
+        self.max_redirects = max_redirects
+        self.dns = dns
+        self.max_hosts = max_hosts
+        self._sessions: 'OrderedDict[str, requests.Session]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, host: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.max_redirects = self.max_redirects
+                adapter = _CachedDNSAdapter(self.dns, pool_connections=4,
+                                            pool_maxsize=self.per_host, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                while len(self._sessions) > self.max_hosts:
+                    self._sessions.popitem(last=False)[1].close()
+            self._sessions.move_to_end(host)
+            return session
+
+    def get(self, url: str, host: str, headers: Dict, timeout: Tuple[float, float],
+            deadline: float, max_bytes: int):
+        with self._session(host).get(url, headers=headers, timeout=timeout, stream=True) as res:
+            connection = getattr(res.raw, 'connection', None)
+            with _Watchdog(deadline, getattr(connection, 'sock', None)) as watchdog:
+                try:
+                    content = _read_limited(res.iter_content(64 * 1024), deadline, max_bytes, url)
+                except self.transient:
+                    if watchdog.fired:
+                        raise FetchError(f"抓取超时: {url}")
+                    raise
+            if watchdog.fired:
+                # 连接被关闭时读到的内容可能不完整
+                raise FetchError(f"抓取超时: {url}")
+            return res.status_code, content, res.headers, res.url
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+# 当前线程正在进行的请求的总超时时刻，httpx 的每次读写都不超过它
+_deadline = threading.local()
+
+
+def _httpx_transport(httpx, httpcore, dns: _DNSCache, limits):
+    """
+    域名解析使用 _DNSCache、每次读写的超时不超过总超时的 httpx 传输层
+    """
+
+    def clamp(timeout):
+        deadline = getattr(_deadline, 'value', None)
+        if deadline is None:
+            return timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise httpcore.ReadTimeout('超过总超时')
+        return remaining if timeout is None else min(timeout, remaining)
+
+    class Stream(httpcore.NetworkStream):
+        def __init__(self, stream):
+            self.stream = stream
+
+        def read(self, max_bytes, timeout=None):
+            return self.stream.read(max_bytes, clamp(timeout))
+
+        def write(self, buffer, timeout=None):
+            self.stream.write(buffer, clamp(timeout))
+
+        def close(self):
+            self.stream.close()
+
+        def start_tls(self, ssl_context, server_hostname=None, timeout=None):
+            return Stream(self.stream.start_tls(ssl_context, server_hostname, clamp(timeout)))
+
+        def get_extra_info(self, info):
+            return self.stream.get_extra_info(info)
+
+    class Backend(httpcore.SyncBackend):
+        def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+            try:
+                address = dns.resolve(host, port)
+            except OSError as e:
+                raise httpcore.ConnectError(str(e)) from e
+            try:
+                stream = super().connect_tcp(address, port, clamp(timeout),
+                                             local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                dns.forget(host)
+                raise
+            return Stream(stream)
+
+    # 与 httpx.HTTPTransport 相同的异常对应关系，子类在前
+    errors = [
+        (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+        (httpcore.ReadTimeout, httpx.ReadTimeout),
+        (httpcore.WriteTimeout, httpx.WriteTimeout),
+        (httpcore.PoolTimeout, httpx.PoolTimeout),
+        (httpcore.ConnectError, httpx.ConnectError),
+        (httpcore.ReadError, httpx.ReadError),
+        (httpcore.WriteError, httpx.WriteError),
+        (httpcore.ProxyError, httpx.ProxyError),
+        (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+        (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+        (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+        (httpcore.TimeoutException, httpx.TimeoutException),
+        (httpcore.NetworkError, httpx.NetworkError),
+        (httpcore.ProtocolError, httpx.ProtocolError),
+    ]
+
+    @contextmanager
+    def mapped_errors():
+        try:
+            yield
+        except Exception as e:
+            for source, target in errors:
+                if isinstance(e, source):
+                    raise target(str(e)) from e
+            raise
+
+    class ResponseStream(httpx.SyncByteStream):
+        def __init__(self, response):
+            self.response = response
+
+        def __iter__(self):
+            with mapped_errors():
+                yield from self.response.iter_stream()
+
+        def close(self):
+            self.response.close()
+
+    class Transport(httpx.BaseTransport):
+        """
+        httpx.HTTPTransport 不能指定网络层，用 httpcore 的连接池实现 httpx 的传输层接口
+        """
+
+        def __init__(self):
+            self.pool = httpcore.ConnectionPool(
+                ssl_context=httpx.create_ssl_context(),
+                max_connections=limits.max_connections,
+                max_keepalive_connections=limits.max_keepalive_connections,
+                keepalive_expiry=limits.keepalive_expiry,
+                http1=True,
+                http2=True,
+                network_backend=Backend(),
+            )
+
+        def handle_request(self, request):
+            core_request = httpcore.Request(
+                method=request.method,
+                url=httpcore.URL(scheme=request.url.raw_scheme, host=request.url.raw_host,
+                                 port=request.url.port, target=request.url.raw_path),
+                headers=request.headers.raw,
+                content=request.stream,
+                extensions=request.extensions,
+            )
+            with mapped_errors():
+                response = self.pool.handle_request(core_request)
+            return httpx.Response(status_code=response.status, headers=response.headers,
+                                  stream=ResponseStream(response),
+                                  extensions=response.extensions)
+
+        def close(self):
+            self.pool.close()
+
+    return Transport()
+
+
+class _HttpxBackend:
+    """
+    httpx 客户端，服务器支持时使用 HTTP/2，同一域名的请求复用一个连接
+    """
+
+    def __init__(self, per_host: int, max_redirects: int, dns: _DNSCache):
+        import httpcore
+        import httpx
+
+        self.httpx = httpx
+        self.transient = (httpx.TransportError,)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=per_host * 16)
+        self.client = httpx.Client(
+            follow_redirects=True,
+            max_redirects=max_redirects,
+            transport=_httpx_transport(httpx, httpcore, dns, limits),
+        )
+
+    def get(self, url: str, host: str, headers: Dict, timeout: Tuple[float, float],
+            deadline: float, max_bytes: int):
+        connect, read = timeout
+        _deadline.value = deadline
+        try:
+            with self.client.stream('GET', url, headers=headers,
+                                    timeout=self.httpx.Timeout(read, connect=connect)) as res:
+                content = _read_limited(res.iter_bytes(64 * 1024), deadline, max_bytes, url)
+                return res.status_code, content, res.headers, str(res.url)
+        except self.httpx.TimeoutException:
+            if time.monotonic() >= deadline:
+                raise FetchError(f"抓取超时: {url}")
+            raise
+        finally:
+            _deadline.value = None
+
+    def close(self):
+        self.client.close()
+
+
+def _read_limited(chunks, deadline: float, max_bytes: int, url: str) -> bytes:
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= max_bytes:
+            # 正文和元数据都在页面前部，超出部分直接丢弃
+            print(f"页面超过 {max_bytes // 1024} KB，已截断: {url}")
+            del buffer[max_bytes:]
+            break
+        if time.monotonic() > deadline:
+            raise FetchError(f"抓取超时: {url}")
+    return bytes(buffer)
+
+
+def _has_http2() -> bool:
+    try:
+        import httpx  # noqa: F401
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _retry_after(headers) -> Optional[float]:
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER)
+
+
+class Fetcher:
+    """
+    抓取文章网页
+    按域名复用连接池，安装了 httpx[http2] 时使用 HTTP/2；域名解析结果缓存；
+    限制重定向次数、连接/读取/总超时和页面大小；同一域名限制并发数和请求间隔，
+    网络错误、限流和服务端临时错误按指数退避重试
+    """
+
+    def __init__(self, connect_timeout: float = 5, read_timeout: float = 15,
+                 total_timeout: float = 30, max_redirects: int = 5, retries: int = 2,
+                 backoff: float = 0.5, host_concurrency: int = 4, host_interval: float = 0.2,
+                 max_bytes: int = 10 * 1024 * 1024, dns_ttl: float = 300, http2: bool = True,
+                 max_elapsed: float = None):
+        """
+        :param connect_timeout: 建立连接超时（秒）
+        :param read_timeout: 两次读取之间的超时（秒）
+        :param total_timeout: 单次请求的总超时（秒），不含重试，到时关闭连接
+        :param max_redirects: 最多跟随的重定向次数
+        :param retries: 临时错误的重试次数
+        :param backoff: 首次重试的等待时间（秒），之后每次翻倍
+        :param host_concurrency: 同一域名同时进行的请求数
+        :param host_interval: 同一域名两次请求开始的最小间隔（秒）
+        :param max_bytes: 页面大小上限，超出部分截断
+        :param dns_ttl: 域名解析缓存时间（秒），为 0 时不缓存
+        :param http2: 是否在安装了 httpx 和 h2 时使用 HTTP/2
+        :param max_elapsed: 包含重试和等待在内的总耗时上限（秒），为 None 时不限制
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.total_timeout = total_timeout
+        self.max_redirects = max_redirects
+        self.retries = retries
+        self.backoff = backoff
+        self.host_concurrency = host_concurrency
+        self.host_interval = host_interval
+        self.max_bytes = max_bytes
+        self.dns_ttl = dns_ttl
+        self.http2 = http2
+        self.max_elapsed = max_elapsed
+        self._backend = None
+        self._limiters: Dict[str, _HostLimiter] = {}
+        self._lock = threading.Lock()
+
+    def _get_backend(self):
+        with self._lock:
+            if self._backend is None:
+                dns = _DNSCache(self.dns_ttl)
+                if self.http2 and _has_http2():
+                    self._backend = _HttpxBackend(self.host_concurrency, self.max_redirects, dns)
+                else:
+                    self._backend = _RequestsBackend(self.host_concurrency, self.max_redirects, dns)
+            return self._backend
+
+    def _limiter(self, host: str) -> _HostLimiter:
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = _HostLimiter(self.host_concurrency,
+                                                              self.host_interval)
+            return limiter
+
+    def get(self, url: str, headers: Dict[str, str] = None) -> Tuple[bytes, str, str]:
+        """
+        抓取网页
+        :param url: 网页链接
+        :param headers: 额外的请求头，如站点专用的 User-Agent
+        :return: (响应内容, Content-Type, 重定向后的链接)
+        :raises FetchError: 重试后仍然失败，或返回了 4xx 状态码
+        """
+        backend = self._get_backend()
+        host = (urllib.parse.urlsplit(url).hostname or '').lower()
+        headers = {'User-Agent': USER_AGENT, **DEFAULT_HEADERS, **(headers or {})}
+        limiter = self._limiter(host)
+        give_up = time.monotonic() + self.max_elapsed if self.max_elapsed else math.inf
+
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2 ** attempt * (0.5 + random.random())
+            try:
+                with limiter:
+                    status, content, res_headers, final_url = backend.get(
+                        url, host, headers, self.timeout,
+                        min(time.monotonic() + self.total_timeout, give_up), self.max_bytes)
+            except backend.transient as e:
+                error = FetchError(f"抓取失败: {url} {type(e).__name__}: {e}")
+            else:
+                if status < 400:
+                    return content, res_headers.get('Content-Type', ''), final_url
+                error = FetchError(f"抓取失败: {url} HTTP {status}", status)
+                if status not in RETRY_STATUS:
+                    raise error
+                wait = _retry_after(res_headers) or wait
+
+            if attempt < self.retries and time.monotonic() + wait < give_up:
+                print(f"{error}，{wait:.1f} 秒后第 {attempt + 1} 次重试")
+                time.sleep(wait)
+        raise error
+
+    def close(self):
+        with self._lock:
+            backend, self._backend = self._backend, None
+        if backend is not None:
+            backend.close()
+
+
+fetcher = Fetcher(
+    config.FETCH_CONNECT_TIMEOUT,
+    config.FETCH_READ_TIMEOUT,
+    config.FETCH_TOTAL_TIMEOUT,
+    config.FETCH_MAX_REDIRECTS,
+    config.FETCH_RETRIES,
+    host_concurrency=config.FETCH_HOST_CONCURRENCY,
+    host_interval=config.FETCH_HOST_INTERVAL,
+    max_bytes=config.FETCH_MAX_BYTES,
+    dns_ttl=config.FETCH_DNS_TTL,
+    http2=config.FETCH_HTTP2,
+    # 重试全部用完也要在任务的可见性超时之前结束，留出解析和打标签的时间
+    max_elapsed=config.JOB_VISIBILITY_TIMEOUT / 3,
+)
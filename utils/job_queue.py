@@ -0,0 +1,392 @@
+import json
+import secrets
+import time
+from typing import Callable, Dict, List, Optional, Any
+
+from utils.sqlite_store import SQLiteStore
+
+
+class QueueFull(Exception):
+    """
+    用户积压的任务数达到上限
+    """
+
+
+class ClaimLost(Exception):
+    """
+    任务执行超过可见性超时后已被重新领取，本次执行的结果不再写回
+    """
+
+
+class JobPostponed(Exception):
+    """
+    任务暂时不能执行，推迟后重新排队，不计入尝试次数
+    """
+
+    def __init__(self, delay: float, reason: str = ''):
+        super().__init__(reason)
+        self.delay = delay
+
+
+class JobQueue(SQLiteStore):
+    """
+    持久化任务队列
+    任务被领取后在可见性超时内不会被其他 worker 领取，worker 崩溃后超时自动重新可见；
+    失败次数达到上限后移入死信表，等待人工重试。
+    任务按用户轮流领取：每次从最久没有被服务的用户中取其最早的任务，
+    相当于每个任务成本相同的差额轮询（DRR），批量导入不会阻塞其他用户的单条链接
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        dedup_key TEXT UNIQUE,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        visible_at REAL NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(status, visible_at);
+    CREATE TABLE IF NOT EXISTS dead_jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        dedup_key TEXT,
+        payload TEXT NOT NULL,
+        attempts INTEGER NOT NULL,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        failed_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS job_users (
+        user_key TEXT PRIMARY KEY,
+        served_at REAL NOT NULL
+    );
+    '''
+
+    def __init__(self, db_path: str, max_attempts: int = 3,
+                 visibility_timeout: float = 300, user_concurrency: int = 2,
+                 user_backlog: int = 300):
+        """
+        :param db_path: 数据库文件路径
+        :param max_attempts: 最大尝试次数
+        :param visibility_timeout: 任务领取后的可见性超时（秒）
+        :param user_concurrency: 每个用户同时执行的任务数上限
+        :param user_backlog: 每个用户未完成的任务数上限，超过后拒绝入队
+        """
+        super().__init__(db_path)
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.user_concurrency = user_concurrency
+        self.user_backlog = user_backlog
+        self.ensure_column('jobs', 'user_key', "TEXT NOT NULL DEFAULT ''")
+        self.ensure_column('dead_jobs', 'user_key', "TEXT NOT NULL DEFAULT ''")
+        self.ensure_column('jobs', 'claim_token', 'TEXT')
+        self.execute('CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_key, status, visible_at)')
+
+    def _to_job(self, row) -> Dict:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], dedup_key: str = None,
+                delay: float = 0, user_key: str = '') -> Optional[int]:
+        """
+        添加任务
+        :param kind: 任务类型
+        :param payload: 任务数据
+        :param dedup_key: 去重键，相同去重键的任务只会添加一次
+        :param delay: 延迟执行（秒）
+        :param user_key: 调度用的用户标识，同一用户的任务按顺序执行，不同用户之间轮流执行；
+                         为空时是内部任务，不受积压和并发上限限制
+        :return: 任务ID，重复任务返回None
+        :raises QueueFull: 用户未完成的任务数达到上限
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            if user_key and self.user_backlog:
+                backlog = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE user_key = ? AND status != 'done'",
+                    (user_key,)
+                ).fetchone()[0]
+                if backlog >= self.user_backlog:
+                    raise QueueFull(f"用户 {user_key} 有 {backlog} 个任务未完成")
+
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO jobs (kind, dedup_key, payload, max_attempts, '
+                'visible_at, user_key, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (kind, dedup_key, json.dumps(payload, ensure_ascii=False),
+                 self.max_attempts, now + delay, user_key, now, now)
+            )
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, on_dead: Callable[[Dict, str], None] = None) -> Optional[Dict]:
+        """
+        领取一个可执行的任务，包括可见性超时后未完成的任务
+        在未达到并发上限的用户中，选择最久没有被服务的用户，领取其最早的任务
+        :param on_dead: 超时且已达到最大尝试次数的任务移入死信表后调用，参数为 (任务, 错误信息)，可选
+        :return: 任务信息，没有任务时返回None；claim_token 为本次领取的凭证，
+                 extend、complete、fail、postpone 时需要带上
+        """
+        buried = []
+        claimed = self._claim(buried)
+        # 事务提交后再通知，回调出错不影响领取
+        if on_dead is not None:
+            for job, error in buried:
+                try:
+                    on_dead(job, error)
+                except Exception as e:
+                    print(f"处理死信任务 {job['id']} 失败: {e}")
+        return claimed
+
+    def _claim(self, buried: List) -> Optional[Dict]:
+        now = time.time()
+        with self.transaction() as conn:
+            expired = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND visible_at <= ?", (now,)
+            ).fetchall()
+            for job in expired:
+                if job['attempts'] >= job['max_attempts']:
+                    # 多次执行中途崩溃的任务不再重试
+                    error = job['last_error'] or '执行超时'
+                    self._bury(conn, job, error)
+                    buried.append((self._to_job(job), error))
+                else:
+                    conn.execute("UPDATE jobs SET status = 'pending' WHERE id = ?", (job['id'],))
+
+            rows = conn.execute(
+                '''
+                WITH heads AS (
+                    SELECT user_key, MIN(id) AS id FROM jobs
+                    WHERE status = 'pending' AND visible_at <= ? GROUP BY user_key
+                ), busy AS (
+                    SELECT user_key, COUNT(*) AS n FROM jobs
+                    WHERE status = 'running' GROUP BY user_key
+                )
+                SELECT jobs.* FROM heads
+                JOIN jobs ON jobs.id = heads.id
+                LEFT JOIN busy ON busy.user_key = heads.user_key
+                LEFT JOIN job_users ON job_users.user_key = heads.user_key
+                WHERE heads.user_key = '' OR COALESCE(busy.n, 0) < ?
+                ORDER BY COALESCE(job_users.served_at, 0), heads.id
+                LIMIT 1
+                ''',
+                (now, self.user_concurrency)
+            ).fetchall()
+            if not rows:
+                return None
+
+            job = rows[0]
+            token = secrets.token_hex(8)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                'visible_at = ?, claim_token = ?, updated_at = ? WHERE id = ?',
+                (now + self.visibility_timeout, token, now, job['id'])
+            )
+            conn.execute(
+                'INSERT INTO job_users (user_key, served_at) VALUES (?, ?) '
+                'ON CONFLICT(user_key) DO UPDATE SET served_at = excluded.served_at',
+                (job['user_key'], now)
+            )
+            job = self._to_job(job)
+            job['attempts'] += 1
+            job['status'] = 'running'
+            job['claim_token'] = token
+            return job
+
+    def extend(self, job_id: int, claim_token: str, timeout: float = None):
+        """
+        延长已领取任务的可见性超时，执行时间较长的任务在各步骤之间调用
+        :param timeout: 从现在起的超时（秒），默认使用 visibility_timeout
+        :raises ClaimLost: 任务已被重新领取
+        """
+        now = time.time()
+        if not self.execute(
+                "UPDATE jobs SET visible_at = ?, updated_at = ? "
+                "WHERE id = ? AND claim_token = ? AND status = 'running'",
+                (now + (timeout or self.visibility_timeout), now, job_id, claim_token)):
+            raise ClaimLost(f"任务 {job_id} 已被重新领取")
+
+    def complete(self, job_id: int, claim_token: str):
+        """
+        标记任务完成
+        :raises ClaimLost: 任务已被重新领取
+        """
+        if not self.execute(
+                "UPDATE jobs SET status = 'done', updated_at = ? "
+                "WHERE id = ? AND claim_token = ? AND status = 'running'",
+                (time.time(), job_id, claim_token)):
+            raise ClaimLost(f"任务 {job_id} 已被重新领取")
+
+    def fail(self, job_id: int, claim_token: str, error: str, retry_delay: float = 30) -> bool:
+        """
+        标记任务失败，未达到最大尝试次数时按指数退避重新排队
+        :param job_id: 任务ID
+        :param claim_token: 领取任务时的凭证
+        :param error: 错误信息
+        :param retry_delay: 首次重试延迟（秒）
+        :return: 是否会重试，False 表示已移入死信表
+        :raises ClaimLost: 任务已被重新领取
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE id = ? AND claim_token = ? AND status = 'running'",
+                (job_id, claim_token)
+            ).fetchall()
+            if not rows:
+                raise ClaimLost(f"任务 {job_id} 已被重新领取")
+
+            job = rows[0]
+            if job['attempts'] >= job['max_attempts']:
+                self._bury(conn, job, error)
+                return False
+
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', visible_at = ?, last_error = ?, "
+                'updated_at = ? WHERE id = ?',
+                (now + retry_delay * 2 ** (job['attempts'] - 1), error, now, job_id)
+            )
+            return True
+
+    def postpone(self, job_id: int, claim_token: str, delay: float):
+        """
+        推迟执行已领取的任务，不计入尝试次数
+        :param delay: 推迟的时间（秒）
+        :raises ClaimLost: 任务已被重新领取
+        """
+        now = time.time()
+        if not self.execute(
+                "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), "
+                "visible_at = ?, updated_at = ? WHERE id = ? AND claim_token = ? "
+                "AND status = 'running'", (now + delay, now, job_id, claim_token)):
+            raise ClaimLost(f"任务 {job_id} 已被重新领取")
+
+    def depth(self, kind: str = None) -> int:
+        """
+        已到执行时间、等待领取的任务数，不含延迟执行和退避中的任务
+        :param kind: 只统计指定类型的任务，可选
+        """
+        sql = "SELECT COUNT(*) FROM jobs WHERE status = 'pending' AND visible_at <= ?"
+        params = (time.time(),)
+        if kind:
+            sql += ' AND kind = ?'
+            params += (kind,)
+        return self.query(sql, params)[0][0]
+
+    def position(self, job_id: int) -> int:
+        """
+        估算任务前面还有多少个任务
+        按用户轮流领取时，其他用户最多排在前面的任务数等于本用户排在前面的任务数加一；
+        不属于任何用户的内部任务（如补打标签）不计入
+        """
+        rows = self.query('SELECT user_key FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return 0
+        user_key = rows[0]['user_key']
+        own = self.query(
+            "SELECT COUNT(*) FROM jobs WHERE user_key = ? AND status = 'pending' AND id < ?",
+            (user_key, job_id)
+        )[0][0]
+        others = self.query(
+            "SELECT COALESCE(SUM(MIN(n, ?)), 0) FROM (SELECT COUNT(*) AS n FROM jobs "
+            "WHERE status = 'pending' AND user_key NOT IN (?, '') GROUP BY user_key)",
+            (own + 1, user_key)
+        )[0][0]
+        return own + others
+
+    def _bury(self, conn, job, error: str):
+        conn.execute(
+            'INSERT OR REPLACE INTO dead_jobs (id, kind, dedup_key, payload, attempts, '
+            'last_error, user_key, created_at, failed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job['id'], job['kind'], job['dedup_key'], job['payload'],
+             job['attempts'], error, job['user_key'], job['created_at'], time.time())
+        )
+        conn.execute('DELETE FROM jobs WHERE id = ?', (job['id'],))
+
+    def retry(self, job_id: int) -> bool:
+        """
+        立即重试任务，死信任务会移回队列并重置尝试次数
+        :return: 是否找到任务
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'pending', visible_at = ?, updated_at = ? "
+                "WHERE id = ? AND status != 'done'", (now, now, job_id)
+            )
+            if cursor.rowcount:
+                return True
+
+            rows = conn.execute('SELECT * FROM dead_jobs WHERE id = ?', (job_id,)).fetchall()
+            if not rows:
+                return False
+
+            job = rows[0]
+            conn.execute('DELETE FROM jobs WHERE id = ? OR dedup_key = ?',
+                         (job_id, job['dedup_key']))
+            conn.execute(
+                'INSERT INTO jobs (id, kind, dedup_key, payload, max_attempts, '
+                'visible_at, last_error, user_key, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job['id'], job['kind'], job['dedup_key'], job['payload'],
+                 self.max_attempts, now, job['last_error'], job['user_key'],
+                 job['created_at'], now)
+            )
+            conn.execute('DELETE FROM dead_jobs WHERE id = ?', (job_id,))
+            return True
+
+    def list_jobs(self, status: str = None, limit: int = 100) -> List[Dict]:
+        """
+        查看队列中的任务
+        :param status: pending、running 或 done，为空时返回未完成的任务
+        """
+        if status:
+            rows = self.query('SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?',
+                              (status, limit))
+        else:
+            rows = self.query("SELECT * FROM jobs WHERE status != 'done' ORDER BY id LIMIT ?",
+                              (limit,))
+        return [self._to_job(row) for row in rows]
+
+    def list_dead(self, limit: int = 100) -> List[Dict]:
+        """
+        查看死信任务
+        """
+        rows = self.query('SELECT * FROM dead_jobs ORDER BY failed_at DESC LIMIT ?', (limit,))
+        return [self._to_job(row) for row in rows]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        各状态任务数量
+        """
+        result = {'pending': 0, 'running': 0, 'done': 0}
+        for row in self.query('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status'):
+            result[row['status']] = row['n']
+        result['dead'] = self.query('SELECT COUNT(*) FROM dead_jobs')[0][0]
+        return result
+
+    def user_stats(self, limit: int = 20) -> List[Dict]:
+        """
+        未完成任务最多的用户
+        """
+        rows = self.query(
+            "SELECT user_key, SUM(status = 'pending') AS pending, "
+            "SUM(status = 'running') AS running FROM jobs WHERE status != 'done' "
+            'GROUP BY user_key ORDER BY COUNT(*) DESC LIMIT ?', (limit,)
+        )
+        return [dict(row) for row in rows]
+
+    def purge_done(self, older_than: float = 7 * 86400) -> int:
+        """
+        清理已完成的旧任务
+        :param older_than: 完成多久之后清理（秒）
+        :return: 清理的任务数
+        """
+        cutoff = time.time() - older_than
+        self.execute('DELETE FROM job_users WHERE served_at < ?', (cutoff,))
+        return self.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < ?",
+                            (cutoff,))
@@ -0,0 +1,154 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import config
+from utils.sqlite_store import SQLiteStore
+
+_scope = contextvars.ContextVar('llm_usage_scope', default={})
+_store = None
+_store_lock = threading.Lock()
+
+GROUPS = {
+    'day': 'day',
+    'open_kfid': 'open_kfid',
+    'model': 'model',
+    'purpose': 'purpose',
+}
+
+
+@contextmanager
+def usage_scope(**attributes):
+    """
+    为范围内的模型调用附加归属信息，如 open_kfid、purpose
+    通过 contextvars 传递，asyncio.to_thread 启动的线程同样生效
+    """
+    token = _scope.set({**_scope.get(), **attributes})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+class UsageStore(SQLiteStore):
+    """
+    模型调用的 token 用量和耗时记录
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS llm_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        day TEXT NOT NULL,
+        model TEXT NOT NULL,
+        purpose TEXT NOT NULL DEFAULT '',
+        open_kfid TEXT NOT NULL DEFAULT '',
+        input_tokens INTEGER NOT NULL DEFAULT 0,
+        output_tokens INTEGER NOT NULL DEFAULT 0,
+        cached_tokens INTEGER NOT NULL DEFAULT 0,
+        latency_ms REAL NOT NULL,
+        ok INTEGER NOT NULL,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_llm_usage_day ON llm_usage(day);
+    '''
+
+    def record(self, model: str, latency: float, usage=None, error: str = None):
+        """
+        记录一次模型调用，归属信息取自 usage_scope
+        :param model: 模型名称
+        :param latency: 耗时（秒）
+        :param usage: 接口返回的 usage，失败时为 None
+        :param error: 错误信息
+        """
+        scope = _scope.get()
+        details = getattr(usage, 'input_tokens_details', None)
+        now = time.time()
+        self.execute(
+            'INSERT INTO llm_usage (created_at, day, model, purpose, open_kfid, input_tokens, '
+            'output_tokens, cached_tokens, latency_ms, ok, error) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (now, time.strftime('%Y-%m-%d', time.localtime(now)), model,
+             scope.get('purpose', ''), scope.get('open_kfid', ''),
+             getattr(usage, 'input_tokens', 0) or 0,
+             getattr(usage, 'output_tokens', 0) or 0,
+             getattr(details, 'cached_tokens', 0) or 0,
+             round(latency * 1000, 1), 0 if error else 1, error)
+        )
+
+    def summary(self, group_by: str = 'day', days: int = 30) -> List[Dict]:
+        """
+        按天、客服账号、模型或用途汇总
+        :param group_by: day、open_kfid、model 或 purpose
+        :param days: 统计最近多少天
+        :return: 每组的调用次数、失败次数、token 数、缓存命中比例和耗时
+        """
+        column = GROUPS.get(group_by)
+        if column is None:
+            raise ValueError(f"不支持的分组: {group_by}")
+        rows = self.query(
+            f'SELECT {column} AS key, COUNT(*) AS calls, SUM(ok = 0) AS errors, '
+            'SUM(input_tokens) AS input_tokens, SUM(output_tokens) AS output_tokens, '
+            'SUM(cached_tokens) AS cached_tokens, AVG(latency_ms) AS avg_latency_ms, '
+            'MAX(latency_ms) AS max_latency_ms, '
+            'AVG(CASE WHEN ok THEN input_tokens END) AS avg_input_tokens '
+            f'FROM llm_usage WHERE created_at >= ? GROUP BY {column} ORDER BY {column} DESC',
+            (time.time() - days * 86400,)
+        )
+        result = []
+        for row in rows:
+            item = dict(row)
+            item['cache_ratio'] = round(item['cached_tokens'] / item['input_tokens'], 3) \
+                if item['input_tokens'] else 0
+            for key in ('avg_latency_ms', 'max_latency_ms', 'avg_input_tokens'):
+                item[key] = round(item[key] or 0, 1)
+            result.append(item)
+        return result
+
+    def purge(self, older_than: float = 180 * 86400) -> int:
+        """
+        清理旧记录
+        :param older_than: 多久之前的记录（秒）
+        """
+        return self.execute('DELETE FROM llm_usage WHERE created_at < ?',
+                            (time.time() - older_than,))
+
+
+def get_usage_store() -> UsageStore:
+    """
+    共享的用量记录，首次记录时才建表
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UsageStore(config.DB_PATH)
+        return _store
+
+
+def record_usage(model: str, latency: float, usage=None, error: str = None):
+    """
+    记录一次模型调用，写入失败不影响调用方
+    """
+    try:
+        get_usage_store().record(model, latency, usage, error)
+    except Exception as e:
+        print(f"记录模型用量失败: {e}")
+
+
+# 查看模型用量
+# python -m utils.llm_usage --by model --days 7
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='按天、客服账号、模型或用途汇总模型用量')
+    parser.add_argument('--by', choices=list(GROUPS), default='day')
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    rows = get_usage_store().summary(args.by, args.days)
+    columns = ['key', 'calls', 'errors', 'input_tokens', 'output_tokens', 'cached_tokens',
+               'cache_ratio', 'avg_input_tokens', 'avg_latency_ms', 'max_latency_ms']
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join(str(row[c]) if row[c] != '' else '-' for c in columns))
@@ -0,0 +1,111 @@
+import hashlib
+import re
+from collections import Counter
+from typing import Optional, Tuple, Iterable
+
+from utils.sqlite_store import SQLiteStore
+
+_NOISE = re.compile(r'[\W_]+')
+
+# 64 位指纹分为 4 段，汉明距离不超过 3 的两个指纹至少有一段完全相同
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+# 正文过短时指纹不可靠，不参与去重
+MIN_TEXT_CHARS = 200
+
+
+def _to_signed(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """
+    计算正文的 64 位 SimHash
+    特征为去掉空白和标点后的字符 n-gram，按出现次数加权
+    :param text: 正文文本
+    :param shingle: n-gram 长度
+    :return: 64 位无符号整数
+    """
+    text = _NOISE.sub('', text.casefold())
+    features = Counter(text[i:i + shingle] for i in range(max(len(text) - shingle + 1, 1)))
+
+    # 按字节统计权重，每个特征只需 8 次累加，最后再展开到 64 个比特位
+    counts = [[0] * 256 for _ in range(8)]
+    for feature, weight in features.items():
+        digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+        for i, byte in enumerate(digest):
+            counts[i][byte] += weight
+
+    fingerprint = 0
+    for i in range(8):
+        table = counts[i]
+        for j in range(8):
+            mask = 1 << j
+            score = sum(w if value & mask else -w for value, w in enumerate(table) if w)
+            if score > 0:
+                fingerprint |= 1 << (i * 8 + j)
+    return fingerprint
+
+
+def bands(fingerprint: int):
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(BANDS)]
+
+
+class FingerprintIndex(SQLiteStore):
+    """
+    正文指纹索引，用于识别以不同链接转载的同一篇文章
+    按分段建立索引，查找相似文章时只比较至少一段相同的候选
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        record_id TEXT PRIMARY KEY,
+        simhash INTEGER NOT NULL,
+        band0 INTEGER NOT NULL,
+        band1 INTEGER NOT NULL,
+        band2 INTEGER NOT NULL,
+        band3 INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_band0 ON fingerprints(band0);
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_band1 ON fingerprints(band1);
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_band2 ON fingerprints(band2);
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_band3 ON fingerprints(band3);
+    '''
+
+    def add(self, record_id: str, fingerprint: int):
+        """
+        添加或更新记录的指纹
+        """
+        self.execute(
+            'INSERT OR REPLACE INTO fingerprints '
+            '(record_id, simhash, band0, band1, band2, band3) VALUES (?, ?, ?, ?, ?, ?)',
+            (record_id, _to_signed(fingerprint), *bands(fingerprint))
+        )
+
+    def remove(self, record_ids: Iterable[str]):
+        """
+        删除记录的指纹
+        """
+        with self.transaction() as conn:
+            for record_id in record_ids:
+                conn.execute('DELETE FROM fingerprints WHERE record_id = ?', (record_id,))
+
+    def find(self, fingerprint: int, max_distance: int = 3) -> Optional[Tuple[str, int]]:
+        """
+        查找最相似的已有记录
+        :param fingerprint: 正文指纹
+        :param max_distance: 最大汉明距离，不超过 3 时结果是精确的
+        :return: (记录ID, 汉明距离)，没有相似记录时返回None
+        """
+        rows = self.query(
+            'SELECT record_id, simhash FROM fingerprints '
+            'WHERE band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?',
+            bands(fingerprint)
+        )
+        best = None
+        for row in rows:
+            distance = ((row['simhash'] & ((1 << 64) - 1)) ^ fingerprint).bit_count()
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (row['record_id'], distance)
+        return best
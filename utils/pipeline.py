@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from utils.tracing import span
+
+
+class StopPipeline(Exception):
+    """
+    步骤主动结束流程，尚未开始的步骤不再执行
+    """
+
+
+class _Skipped(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    按依赖关系执行的步骤图
+    没有依赖关系的步骤并发执行，同步函数放到线程中运行，并记录每个步骤的耗时
+    """
+
+    def __init__(self, name: str = 'pipeline', before_stage: Callable[[str], Any] = None):
+        """
+        :param name: 流程名称
+        :param before_stage: 每个步骤开始前调用，参数为步骤名称，在线程中运行，抛出异常时流程按出错处理，可选
+        """
+        self.name = name
+        self.before_stage = before_stage
+        self.stages: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+        self.timings: Dict[str, Tuple[float, float]] = {}
+        self.stopped = False
+        self._error = None
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any],
+            deps: Tuple[str, ...] = ()) -> 'Pipeline':
+        """
+        添加步骤
+        :param name: 步骤名称
+        :param func: 步骤函数，参数为已完成步骤的结果字典，可以是同步或异步函数
+        :param deps: 依赖的步骤名称，必须先添加
+        """
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"步骤 {name} 依赖的 {dep} 不存在")
+        self.stages[name] = (func, tuple(deps))
+        return self
+
+    async def _execute(self, name: str, tasks: Dict[str, asyncio.Future],
+                       results: Dict[str, Any], start: float):
+        func, deps = self.stages[name]
+        if deps:
+            await asyncio.gather(*(tasks[d] for d in deps))
+        if self._error is not None:
+            raise _Skipped()
+
+        begin = time.perf_counter()
+        try:
+            if self.before_stage is not None:
+                await asyncio.to_thread(self.before_stage, name)
+            if asyncio.iscoroutinefunction(func):
+                with span(name):
+                    value = await func(results)
+            else:
+                value = await asyncio.to_thread(self._call, name, func, results)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            raise
+        finally:
+            self.timings[name] = (begin - start, time.perf_counter() - start)
+
+        results[name] = value
+        return value
+
+    @staticmethod
+    def _call(name: str, func: Callable, results: Dict[str, Any]):
+        # 在工作线程中开始 span，采样时 cProfile 记录的是执行步骤的线程
+        with span(name):
+            return func(results)
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        执行全部步骤
+        某个步骤出错后，已开始的步骤会执行完，尚未开始的步骤跳过
+        :return: 各步骤的结果，步骤抛出 StopPipeline 时 stopped 为 True
+        """
+        results: Dict[str, Any] = {}
+        self.timings = {}
+        self.stopped = False
+        self._error = None
+        start = time.perf_counter()
+
+        tasks: Dict[str, asyncio.Future] = {}
+        for name in self.stages:
+            tasks[name] = asyncio.ensure_future(self._execute(name, tasks, results, start))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        if isinstance(self._error, StopPipeline):
+            self.stopped = True
+        elif self._error is not None:
+            raise self._error
+        return results
+
+    def critical_path(self) -> List[str]:
+        """
+        关键路径：从最后完成的步骤开始，沿最晚完成的依赖向前回溯
+        """
+        if not self.timings:
+            return []
+        current = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [current]
+        while True:
+            deps = [d for d in self.stages[current][1] if d in self.timings]
+            if not deps:
+                break
+            current = max(deps, key=lambda n: self.timings[n][1])
+            path.append(current)
+        return path[::-1]
+
+    def report(self) -> str:
+        """
+        各步骤耗时和关键路径
+        """
+        stages = ' | '.join(
+            f"{name} {end - begin:.2f}s"
+            for name, (begin, end) in sorted(self.timings.items(), key=lambda i: i[1][0])
+        )
+        total = max((end for _, end in self.timings.values()), default=0)
+        return (f"{self.name} 总耗时 {total:.2f}s: {stages}；"
+                f"关键路径: {' -> '.join(self.critical_path())}")
@@ -0,0 +1,197 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, List
+
+from utils.sqlite_store import SQLiteStore
+
+_CJK_RUN = re.compile('[぀-ヿ㐀-䶿一-鿿豈-﫿가-힯]+')
+_WORD = re.compile(r'[A-Za-z][A-Za-z0-9+#.\-]*[A-Za-z0-9+#]|[A-Za-z]{2,}')
+
+_STOPWORDS = {
+    'the', 'and', 'for', 'with', 'that', 'this', 'from', 'are', 'was', 'you',
+    'your', 'not', 'but', 'can', 'all', 'have', 'has', 'will', 'http', 'https',
+    'www', 'com', 'html',
+    '我们', '你们', '他们', '自己', '一个', '一种', '这个', '那个', '这些', '那些',
+    '可以', '没有', '什么', '因为', '所以', '但是', '如果', '就是', '已经', '还是',
+    '以及', '进行', '通过', '今天', '是一', '的是', '也是', '都是', '不是', '时候',
+}
+
+
+def terms(text: str) -> List[str]:
+    """
+    切分关键词候选：英文单词和中文二元组
+    """
+    result = [w.casefold() for w in _WORD.findall(text)]
+    result = [w for w in result if w not in _STOPWORDS]
+    for run in _CJK_RUN.findall(text):
+        result.extend(b for b in (run[i:i + 2] for i in range(len(run) - 1))
+                      if b not in _STOPWORDS)
+    return result
+
+
+def _merge_bigrams(text: str, selected: set, max_len: int = 8) -> Counter:
+    """
+    将正文中相邻的高分二元组合并为短语，如 数据 + 据库 -> 数据库
+    """
+    phrases = Counter()
+    for run in _CJK_RUN.findall(text):
+        i = 0
+        while i < len(run) - 1:
+            if run[i:i + 2] not in selected:
+                i += 1
+                continue
+            j = i
+            while j + 1 < len(run) - 1 and run[j + 1:j + 3] in selected and j + 3 - i <= max_len:
+                j += 1
+            phrases[run[i:j + 2]] += 1
+            i = j + 2
+    return phrases
+
+
+class KeywordIndex(SQLiteStore):
+    """
+    本地 TF-IDF 关键词提取
+    文档频率随保存的文章累积，语料越多关键词越准确
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS term_df (
+        term TEXT PRIMARY KEY,
+        df INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS term_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    '''
+
+    def add_document(self, text: str):
+        """
+        将文章计入文档频率
+        """
+        unique = set(terms(text))
+        with self.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO term_df (term, df) VALUES (?, 1) '
+                'ON CONFLICT(term) DO UPDATE SET df = df + 1',
+                [(t,) for t in unique]
+            )
+            conn.execute(
+                "INSERT INTO term_meta (key, value) VALUES ('documents', 1) "
+                'ON CONFLICT(key) DO UPDATE SET value = value + 1'
+            )
+
+    def top_keywords(self, text: str, n: int = 15, candidates: int = 300) -> List[str]:
+        """
+        提取文章关键词
+        :param text: 正文文本
+        :param n: 返回的关键词数量
+        :param candidates: 按词频预选的候选数量，只查询这些词的文档频率
+        :return: 按 TF-IDF 降序的关键词
+        """
+        tf = Counter(terms(text))
+        if not tf:
+            return []
+
+        top = [t for t, _ in tf.most_common(candidates)]
+        rows = self.query(
+            f"SELECT term, df FROM term_df WHERE term IN ({','.join('?' * len(top))})", top
+        )
+        df = {row['term']: row['df'] for row in rows}
+        meta = self.query("SELECT value FROM term_meta WHERE key = 'documents'")
+        documents = meta[0]['value'] if meta else 0
+
+        score = {t: tf[t] * (math.log((documents + 1) / (df.get(t, 0) + 1)) + 1) for t in top}
+        ranked = sorted(top, key=score.get, reverse=True)
+
+        # 重复出现的中文二元组合并为短语后再排序，短语得分取其中二元组的最高分
+        cjk = {t for t in ranked[:n * 3] if _CJK_RUN.fullmatch(t)}
+        keywords = {t: score[t] for t in ranked[:n * 3] if t not in cjk}
+        selected = {t for t in cjk if tf[t] > 1}
+        for phrase, count in _merge_bigrams(text, selected).items():
+            if count > 1:
+                keywords[phrase] = max(score[phrase[i:i + 2]] for i in range(len(phrase) - 1))
+        # 没能合并成短语的二元组按原得分补充
+        for t in cjk:
+            if not any(t in k for k in keywords):
+                keywords[t] = score[t]
+        return sorted(keywords, key=keywords.get, reverse=True)[:n]
+
+
+def _score_tags(text: str, tags: List[str]) -> List[tuple]:
+    haystack = text.casefold()
+    present = set(terms(text))
+    scored = []
+    for i, tag in enumerate(tags):
+        key = tag.casefold()
+        if key in haystack:
+            score = 2.0
+        else:
+            parts = terms(tag) or [key]
+            score = sum(p in present for p in parts) / len(parts)
+        if score > 0:
+            scored.append((score, -i, tag))
+    return sorted(scored, reverse=True)
+
+
+def relevant_tags(text: str, tags: List[str], limit: int = 50) -> List[str]:
+    """
+    从已有标签中预选与文章相关的标签
+    标签完整出现在文章中得分最高，其次按标签二元组的命中比例打分
+    :param text: 用于匹配的文本，通常是压缩后的文档
+    :param tags: 已有标签，按常用程度排序时，不足 limit 个的部分用靠前的标签补齐
+    :param limit: 最多返回的标签数
+    """
+    if len(tags) <= limit:
+        return list(tags)
+
+    selected = [tag for _, _, tag in _score_tags(text, tags)[:limit]]
+    for tag in tags:
+        if len(selected) >= limit:
+            break
+        if tag not in selected:
+            selected.append(tag)
+    return selected
+
+
+def local_tags(text: str, tags: List[str], limit: int = 3, min_score: float = 1.0) -> List[str]:
+    """
+    不调用模型，直接从已有标签中选出文章明确提到的标签，用于系统繁忙时降级
+    :param min_score: 最低得分，2 为标签完整出现，1 为标签的二元组全部出现
+    """
+    return [tag for score, _, tag in _score_tags(text, tags) if score >= min_score][:limit]
+
+
+def compact_document(article: Dict, title: str = '', desc: str = '',
+                     keywords: List[str] = None, max_paragraphs: int = 5,
+                     max_chars: int = 2000) -> str:
+    """
+    构造压缩后的文档：标题、描述、小标题、开头几段和关键词
+    :param article: extract_article 的结果
+    :param title: 链接消息的标题，为空时使用网页标题
+    :param desc: 链接消息的描述
+    :param keywords: 关键词
+    :param max_paragraphs: 保留的段落数
+    :param max_chars: 段落部分的最大字符数
+    """
+    lines = [f"标题：{title or article.get('title', '')}"]
+    if desc:
+        lines.append(f"描述：{desc}")
+
+    headings = article.get('headings') or []
+    if headings:
+        lines.append('小标题：' + '；'.join(headings[:15]))
+
+    paragraphs, size = [], 0
+    for paragraph in article.get('paragraphs') or []:
+        if len(paragraphs) >= max_paragraphs or size >= max_chars:
+            break
+        paragraph = paragraph[:max_chars - size]
+        paragraphs.append(paragraph)
+        size += len(paragraph)
+    if paragraphs:
+        lines.append('正文开头：\n' + '\n'.join(paragraphs))
+
+    if keywords:
+        lines.append('关键词：' + '、'.join(keywords))
+    return '\n'.join(lines)
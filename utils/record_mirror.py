@@ -0,0 +1,282 @@
+import json
+import time
+from typing import Dict, List, Optional, Any, Iterable, Iterator
+
+from utils.sqlite_store import SQLiteStore
+
+
+def field_text(value: Any) -> str:
+    """
+    将飞书字段值转换为纯文本
+    文本字段可能返回富文本片段列表，超链接字段返回 {text, link}
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return value.get('link') or value.get('text') or ''
+    if isinstance(value, list):
+        return ''.join(field_text(v) for v in value)
+    return str(value)
+
+
+def field_options(value: Any) -> List[str]:
+    """
+    将多选字段值转换为选项名列表
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [field_text(v) for v in value]
+
+
+class RecordMirror(SQLiteStore):
+    """
+    飞书多维表格的本地 SQLite 镜像
+    写入记录后立即更新镜像，并通过定期扫描同步飞书界面上的修改：
+    平时只按修改时间字段读取最近修改的记录，定期全量扫描一次以发现删除的记录
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS records (
+        record_id TEXT PRIMARY KEY,
+        url TEXT,
+        title TEXT,
+        fields TEXT NOT NULL,
+        last_modified_time INTEGER NOT NULL DEFAULT 0,
+        synced_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_records_url ON records(url);
+    CREATE TABLE IF NOT EXISTS record_tags (
+        record_id TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        PRIMARY KEY (record_id, tag)
+    );
+    CREATE INDEX IF NOT EXISTS idx_record_tags_tag ON record_tags(tag);
+    CREATE TABLE IF NOT EXISTS mirror_state (
+        key TEXT PRIMARY KEY,
+        value REAL NOT NULL
+    );
+    '''
+
+    def __init__(self, db_path: str, table, view_id: str = None,
+                 url_field: str = '链接', title_field: str = '标题',
+                 tag_field: str = '分类', modified_field: str = None,
+                 full_sync_interval: float = 86400):
+        """
+        :param db_path: 数据库文件路径
+        :param table: FeishuTable 实例
+        :param view_id: 同步时使用的视图ID，可选
+        :param url_field: 链接字段名
+        :param title_field: 标题字段名
+        :param tag_field: 分类字段名
+        :param modified_field: “最后更新时间”类型的字段名，用于增量同步，为空时每次全量扫描
+        :param full_sync_interval: 全量扫描的间隔（秒）
+        """
+        super().__init__(db_path)
+        self.table = table
+        self.view_id = view_id
+        self.url_field = url_field
+        self.title_field = title_field
+        self.tag_field = tag_field
+        self.modified_field = modified_field
+        self.full_sync_interval = full_sync_interval
+        self._modified_field_checked = False
+
+    def _has_modified_field(self) -> bool:
+        # 首次同步时确认表格中有修改时间字段，没有时改为每次全量扫描
+        if self.modified_field and not self._modified_field_checked:
+            if not self.table.get_field(self.view_id, self.modified_field):
+                print(f"表格中没有“{self.modified_field}”字段，镜像每次同步都全量扫描")
+                self.modified_field = None
+            self._modified_field_checked = True
+        return bool(self.modified_field)
+
+    def _get_state(self, key: str) -> float:
+        rows = self.query('SELECT value FROM mirror_state WHERE key = ?', (key,))
+        return rows[0]['value'] if rows else 0
+
+    def _set_state(self, key: str, value: float):
+        self.execute('INSERT OR REPLACE INTO mirror_state (key, value) VALUES (?, ?)', (key, value))
+
+    def _write(self, conn, record: Dict):
+        record_id = record['record_id']
+        fields = record.get('fields', {})
+        conn.execute(
+            'INSERT OR REPLACE INTO records '
+            '(record_id, url, title, fields, last_modified_time, synced_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (record_id,
+             field_text(fields.get(self.url_field)),
+             field_text(fields.get(self.title_field)),
+             json.dumps(fields, ensure_ascii=False),
+             record.get('last_modified_time') or 0,
+             time.time())
+        )
+        conn.execute('DELETE FROM record_tags WHERE record_id = ?', (record_id,))
+        conn.executemany(
+            'INSERT OR IGNORE INTO record_tags (record_id, tag) VALUES (?, ?)',
+            [(record_id, t) for t in field_options(fields.get(self.tag_field)) if t]
+        )
+
+    def upsert_records(self, records: Iterable[Dict]):
+        """
+        写入或更新多条记录
+        :param records: 飞书记录列表，需包含 record_id 和 fields
+        """
+        with self.transaction() as conn:
+            for record in records:
+                if record and record.get('record_id'):
+                    self._write(conn, record)
+
+    def upsert_record(self, record: Dict):
+        """
+        写入或更新单条记录，通常在调用 create_record 之后立即调用
+        """
+        self.upsert_records([record])
+
+    def delete_records(self, record_ids: Iterable[str]):
+        """
+        删除多条记录
+        """
+        with self.transaction() as conn:
+            for record_id in record_ids:
+                conn.execute('DELETE FROM records WHERE record_id = ?', (record_id,))
+                conn.execute('DELETE FROM record_tags WHERE record_id = ?', (record_id,))
+
+    def sync(self, batch_size: int = 500, listener=None, full: bool = False) -> Dict:
+        """
+        同步飞书表格的修改，只写入修改时间有变化的记录
+        配置了修改时间字段时只读取上次同步前一天以来修改的记录；
+        全量扫描时读取全部记录，并删除飞书中已不存在的记录
+        :param batch_size: 每批写入的记录数
+        :param listener: 变更回调 listener(records, removed_ids)，可选
+        :param full: 强制全量扫描；没有修改时间字段、从未全量扫描或距上次全量扫描超过
+                     full_sync_interval 时也会全量扫描
+        :return: 同步统计
+        """
+        start = time.time()
+        last_sync = self._get_state('last_sync')
+        full = full or not self._has_modified_field() or not last_sync or \
+            start - self._get_state('last_full_sync') >= self.full_sync_interval
+
+        if full:
+            result = self._scan(None, batch_size, listener, True)
+            self._set_state('last_full_sync', start)
+        else:
+            # 筛选公式按天比较，往前多取一天，避免时区和时钟误差漏掉修改
+            since = time.strftime('%Y-%m-%d', time.localtime(last_sync - 86400))
+            result = self._scan(f'CurrentValue.[{self.modified_field}]>=TODATE("{since}")',
+                                batch_size, listener, False)
+        self._set_state('last_sync', start)
+
+        return {
+            'mode': 'full' if full else 'delta',
+            **result,
+            'elapsed': round(time.time() - start, 3),
+        }
+
+    def _scan(self, filter: Optional[str], batch_size: int, listener, remove: bool) -> Dict:
+        """
+        读取记录并写入变化的部分
+        :param filter: 筛选公式，为空时读取全部记录
+        :param remove: 是否删除本次没有读到的记录，只能在读取全部记录时使用
+        """
+        if remove:
+            known = {row['record_id']: row['last_modified_time']
+                     for row in self.query('SELECT record_id, last_modified_time FROM records')}
+        seen = set()
+        changed = []
+        scanned = updated = 0
+
+        for record in self.table.iter_records(self.view_id, filter=filter, automatic_fields=True):
+            scanned += 1
+            record_id = record['record_id']
+            seen.add(record_id)
+            if remove:
+                stored = known.get(record_id)
+            else:
+                rows = self.query('SELECT last_modified_time FROM records WHERE record_id = ?',
+                                  (record_id,))
+                stored = rows[0]['last_modified_time'] if rows else None
+            if stored == record.get('last_modified_time'):
+                continue
+            changed.append(record)
+            if len(changed) >= batch_size:
+                self.upsert_records(changed)
+                if listener:
+                    listener(changed, [])
+                updated += len(changed)
+                changed = []
+
+        if changed:
+            self.upsert_records(changed)
+            if listener:
+                listener(changed, [])
+            updated += len(changed)
+
+        removed = [record_id for record_id in known if record_id not in seen] if remove else []
+        if removed:
+            self.delete_records(removed)
+            if listener:
+                listener([], removed)
+
+        return {
+            'scanned': scanned,
+            'updated': updated,
+            'deleted': len(removed),
+        }
+
+    def _to_record(self, row) -> Dict:
+        return {
+            'record_id': row['record_id'],
+            'fields': json.loads(row['fields']),
+            'last_modified_time': row['last_modified_time'],
+        }
+
+    def all_records(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """
+        分批遍历镜像中的全部记录
+        """
+        last_id = ''
+        while True:
+            rows = self.query(
+                'SELECT * FROM records WHERE record_id > ? ORDER BY record_id LIMIT ?',
+                (last_id, batch_size)
+            )
+            if not rows:
+                break
+            for row in rows:
+                yield self._to_record(row)
+            last_id = rows[-1]['record_id']
+
+    def get_record(self, record_id: str) -> Optional[Dict]:
+        """
+        按记录ID查询
+        """
+        rows = self.query('SELECT * FROM records WHERE record_id = ?', (record_id,))
+        return self._to_record(rows[0]) if rows else None
+
+    def find_by_url(self, url: str) -> Optional[Dict]:
+        """
+        按链接查询已保存的记录，用于去重
+        """
+        rows = self.query('SELECT * FROM records WHERE url = ? LIMIT 1', (url,))
+        return self._to_record(rows[0]) if rows else None
+
+    def count(self) -> int:
+        """
+        记录总数
+        """
+        return self.query('SELECT COUNT(*) FROM records')[0][0]
+
+    def tag_counts(self, limit: int = 100) -> List[Dict]:
+        """
+        各分类标签的记录数，按数量降序
+        """
+        rows = self.query(
+            'SELECT tag, COUNT(*) AS n FROM record_tags '
+            'GROUP BY tag ORDER BY n DESC LIMIT ?', (limit,)
+        )
+        return [{'tag': row['tag'], 'count': row['n']} for row in rows]
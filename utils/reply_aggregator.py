@@ -0,0 +1,192 @@
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+# 客服文本消息内容最长 2048 字节
+MAX_CONTENT_BYTES = 2000
+
+SAVED = 'saved'
+FAILED = 'failed'
+DUPLICATE = 'duplicate'
+
+
+class _UserReplies:
+    def __init__(self, msgid: str, now: float):
+        self.msgid = msgid
+        self.in_flight = set()
+        self.ack_titles: List[str] = []
+        self.ack_at = 0
+        self.results: List[Tuple[str, str, str]] = []
+        self.result_at = 0
+        self.notices: List[str] = []
+        self.notice_at = 0
+        self.last_at = now
+
+
+class ReplyAggregator:
+    """
+    按用户合并回复消息
+    短时间内连续转发的多个链接只回复一条开始保存的消息，全部处理完后再回复一条汇总，
+    减少 kf/send_msg 调用次数。每个进程单独合并，多进程部署时同一用户可能收到多条汇总
+    """
+
+    def __init__(self, send: Callable[[str, str, str, str], object],
+                 window: float = 3, max_delay: float = 60):
+        """
+        :param send: 发送函数，参数为 (open_kfid, external_userid, msgid, content)
+        :param window: 合并窗口（秒），用户在窗口内没有新消息时才发送
+        :param max_delay: 汇总的最长等待时间（秒），批量导入时按此间隔分批汇总
+        """
+        self.send = send
+        self.window = window
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._users: Dict[Tuple[str, str], _UserReplies] = {}
+
+    def _user(self, open_kfid: str, user_id: str, msgid: str = '') -> _UserReplies:
+        now = time.time()
+        state = self._users.get((open_kfid, user_id))
+        if state is None:
+            state = self._users[(open_kfid, user_id)] = _UserReplies(msgid, now)
+        state.last_at = now
+        return state
+
+    def started(self, open_kfid: str, user_id: str, key: str, title: str, msgid: str = '',
+                ack: bool = True):
+        """
+        开始处理一个链接
+        :param key: 链接的唯一标识，通常是消息ID，结束时用同一个标识
+        :param title: 文章标题
+        :param msgid: 回复使用的消息ID
+        :param ack: 是否需要回复开始保存，重试时为 False
+        """
+        with self._lock:
+            state = self._user(open_kfid, user_id, msgid)
+            state.in_flight.add(key)
+            if not ack:
+                return
+            if not state.ack_titles:
+                state.ack_at = time.time()
+                state.msgid = msgid or state.msgid
+            state.ack_titles.append(title)
+
+    def finished(self, open_kfid: str, user_id: str, key: str, title: str,
+                 status: str = SAVED, detail: str = ''):
+        """
+        链接处理结束
+        :param status: saved、failed 或 duplicate
+        :param detail: 失败原因或重复说明
+        """
+        with self._lock:
+            state = self._user(open_kfid, user_id)
+            state.in_flight.discard(key)
+            if not state.results:
+                state.result_at = time.time()
+            state.results.append((status, title, detail))
+
+    def abandon(self, open_kfid: str, user_id: str, key: str):
+        """
+        链接本次处理失败但稍后会重试，暂不汇总
+        """
+        with self._lock:
+            state = self._users.get((open_kfid, user_id))
+            if state is not None:
+                state.in_flight.discard(key)
+
+    def notice(self, open_kfid: str, user_id: str, content: str):
+        """
+        其他提示消息，窗口内相同的提示只发送一次
+        从第一条提示开始计算窗口，不受开始保存和保存结果的影响
+        不带消息ID发送：收到的消息ID已经用于开始保存的回复，同一个ID不能发送两条消息
+        """
+        with self._lock:
+            state = self._users.get((open_kfid, user_id))
+            if state is None:
+                state = self._users[(open_kfid, user_id)] = _UserReplies('', time.time())
+            if not state.notices:
+                state.notice_at = time.time()
+            if content not in state.notices:
+                state.notices.append(content)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        发送已到期的合并消息
+        :param force: 忽略合并窗口，立即发送全部消息，用于停止服务前
+        :return: 发送的消息数
+        """
+        now = time.time()
+        outgoing = []
+        with self._lock:
+            for (open_kfid, user_id), state in list(self._users.items()):
+                quiet = force or now - state.last_at >= self.window
+                # 提示按自己的窗口发送，批量导入期间持续到达的链接不会把提示一直压住
+                if state.notices and (force or now - state.notice_at >= self.window):
+                    for content in state.notices:
+                        outgoing.append((open_kfid, user_id, '', content))
+                    state.notices = []
+
+                if state.ack_titles and (force or now - state.ack_at >= self.window):
+                    # 窗口内已经全部处理完的，直接发汇总，不再发开始保存
+                    if state.in_flight:
+                        outgoing.append((open_kfid, user_id, state.msgid,
+                                         self._ack_text(state.ack_titles)))
+                    # 每个消息ID只用于一条回复
+                    state.ack_titles = []
+                    state.msgid = ''
+
+                if state.results and not state.ack_titles and (
+                        (quiet and not state.in_flight) or now - state.result_at >= self.max_delay):
+                    outgoing.append((open_kfid, user_id, '', self._summary_text(state.results)))
+                    state.results = []
+
+                if not (state.in_flight or state.ack_titles or state.results or state.notices):
+                    del self._users[(open_kfid, user_id)]
+
+        for open_kfid, user_id, msgid, content in outgoing:
+            try:
+                self.send(open_kfid, user_id, msgid, content)
+            except Exception as e:
+                print(f"发送回复失败: {e}")
+        return len(outgoing)
+
+    @staticmethod
+    def _ack_text(titles: List[str]) -> str:
+        if len(titles) == 1:
+            return '开始保存文章，请稍等...'
+        return f"开始保存 {len(titles)} 篇文章，请稍等..."
+
+    @staticmethod
+    def _summary_text(results: List[Tuple[str, str, str]]) -> str:
+        if len(results) == 1:
+            status, title, detail = results[0]
+            if status == SAVED:
+                return '文章保存成功！'
+            if status == DUPLICATE:
+                return detail or '这篇文章已经保存过了'
+            return f"文章保存失败：{title}\n{detail}"
+
+        groups = {SAVED: [], FAILED: [], DUPLICATE: []}
+        for status, title, detail in results:
+            groups[status].append((title, detail))
+
+        counts = [f"已保存 {len(groups[SAVED])} 篇"]
+        if groups[FAILED]:
+            counts.append(f"{len(groups[FAILED])} 篇失败")
+        if groups[DUPLICATE]:
+            counts.append(f"{len(groups[DUPLICATE])} 篇之前已保存")
+        lines = ['，'.join(counts)]
+        for status, label in ((FAILED, '失败'), (SAVED, '成功'), (DUPLICATE, '已保存过')):
+            if groups[status]:
+                lines.append(f"\n{label}：")
+                lines.extend(f"- {title}" + (f"（{detail}）" if status == FAILED and detail else '')
+                             for title, detail in groups[status])
+
+        # 超出长度时截断列表
+        text, size = [], 0
+        for i, line in enumerate(lines):
+            size += len(line.encode('utf-8')) + 1
+            if size > MAX_CONTENT_BYTES - 30:
+                text.append(f"……还有 {len(lines) - i} 行未显示")
+                break
+            text.append(line)
+        return '\n'.join(text)
@@ -0,0 +1,291 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import config
+from utils.sqlite_store import SQLiteStore
+from utils.record_mirror import field_text, field_options
+
+
+class RetagStore(SQLiteStore):
+    """
+    重新打标签任务的模型结果缓存和断点
+    缓存键包含文档内容、模型和开始时的标签词表，先试运行再正式运行时不会重复调用模型
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS retag_cache (
+        key TEXT PRIMARY KEY,
+        tags TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS retag_checkpoints (
+        name TEXT PRIMARY KEY,
+        page_token TEXT,
+        scanned INTEGER NOT NULL,
+        changed INTEGER NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    '''
+
+    def get_cached(self, key: str) -> Optional[List[str]]:
+        rows = self.query('SELECT tags FROM retag_cache WHERE key = ?', (key,))
+        return json.loads(rows[0]['tags']) if rows else None
+
+    def set_cached(self, key: str, tags: List[str]):
+        self.execute('INSERT OR REPLACE INTO retag_cache (key, tags, created_at) VALUES (?, ?, ?)',
+                     (key, json.dumps(tags, ensure_ascii=False), time.time()))
+
+    def load_checkpoint(self, name: str) -> Optional[Dict]:
+        rows = self.query('SELECT * FROM retag_checkpoints WHERE name = ?', (name,))
+        return dict(rows[0]) if rows else None
+
+    def save_checkpoint(self, name: str, page_token: str, scanned: int, changed: int):
+        self.execute(
+            'INSERT OR REPLACE INTO retag_checkpoints (name, page_token, scanned, changed, updated_at) '
+            'VALUES (?, ?, ?, ?, ?)', (name, page_token, scanned, changed, time.time())
+        )
+
+    def clear_checkpoint(self, name: str):
+        self.execute('DELETE FROM retag_checkpoints WHERE name = ?', (name,))
+
+
+class RetagJob:
+    """
+    按当前标签词表重新为已有记录打标签
+    分页读取飞书表格，每页内并发调用模型，变化的记录通过一次批量更新写回，
+    每页写完后保存分页标记，中断后从断点继续
+    """
+
+    def __init__(self, table, vocabulary, store: RetagStore, view_id: str = None,
+                 mirror=None, search_index=None, keyword_index=None,
+                 source: str = 'page', concurrency: int = 4, keep_existing: bool = False,
+                 dry_run: bool = False, model: str = 'gpt-4.1', name: str = 'retag'):
+        """
+        :param table: FeishuTable 实例
+        :param vocabulary: TagVocabulary 实例
+        :param store: RetagStore 实例
+        :param view_id: 视图ID，可选
+        :param mirror: RecordMirror 实例，写回后同步更新本地镜像，可选
+        :param search_index: SearchIndex 实例，可选
+        :param keyword_index: KeywordIndex 实例，抓取正文时用于提取关键词，可选
+        :param source: page 抓取网页正文，meta 只使用标题和描述
+        :param concurrency: 同时调用模型的数量
+        :param keep_existing: 保留原有标签，只追加新标签
+        :param dry_run: 只输出差异，不写回飞书
+        :param model: 模型名称
+        :param name: 断点名称，试运行使用单独的断点
+        """
+        self.table = table
+        self.vocabulary = vocabulary
+        self.store = store
+        self.view_id = view_id
+        self.mirror = mirror
+        self.search_index = search_index
+        self.keyword_index = keyword_index
+        self.source = source
+        self.concurrency = concurrency
+        self.keep_existing = keep_existing
+        self.dry_run = dry_run
+        self.model = model
+        self.name = f'{name}:dry-run' if dry_run else name
+        self.options: List[str] = []
+        self._vocabulary_version = ''
+        self.stats = {'scanned': 0, 'changed': 0, 'written': 0, 'llm_calls': 0,
+                      'cache_hits': 0, 'fetch_failures': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _document(self, fields: Dict) -> str:
+        from utils.prompt_compactor import compact_document
+
+        title = field_text(fields.get('标题'))
+        desc = field_text(fields.get('描述'))
+        url = field_text(fields.get('链接'))
+        if self.source == 'page' and url:
+            from utils.extractor import fetch_page, parse_page
+            try:
+                article = parse_page(*fetch_page(url))
+                keywords = self.keyword_index.top_keywords(
+                    article['text'], config.COMPACT_KEYWORDS) if self.keyword_index else None
+                return compact_document(article, title, desc, keywords, config.COMPACT_PARAGRAPHS)
+            except Exception as e:
+                print(f"抓取失败，只使用标题和描述: {url} {e}")
+                self._count('fetch_failures')
+        return compact_document({}, title, desc)
+
+    def _retag(self, record: Dict) -> Tuple[Dict, Optional[List[str]]]:
+        from utils.llm_usage import usage_scope
+        from utils.prompt_compactor import relevant_tags
+        from utils.tagger import gen_tags
+
+        try:
+            doc = self._document(record.get('fields', {}))
+            key = hashlib.sha1(
+                f'{self.model}\n{self._vocabulary_version}\n{doc}'.encode('utf-8')).hexdigest()
+            tags = self.store.get_cached(key)
+            if tags is None:
+                with usage_scope(purpose='backfill'):
+                    tags = gen_tags(doc, relevant_tags(doc, self.options, config.COMPACT_TAGS),
+                                    self.model)
+                self._count('llm_calls')
+                self.store.set_cached(key, tags)
+            else:
+                self._count('cache_hits')
+            return record, tags
+        except Exception as e:
+            print(f"记录 {record.get('record_id')} 打标签失败: {e}")
+            self._count('errors')
+            return record, None
+
+    def _process_page(self, records: List[Dict], executor, diff_file) -> List[Dict]:
+        changes = []
+        for record, raw_tags in executor.map(self._retag, records):
+            if raw_tags is None:
+                continue
+            fields = record.get('fields', {})
+            old = field_options(fields.get('分类'))
+            new = self.vocabulary.resolve(raw_tags)
+            if self.keep_existing:
+                new = old + [t for t in new if t not in old]
+            if set(new) == set(old):
+                continue
+
+            created = [t for t in new if self.vocabulary.has_pending([t])]
+            print(f"{record['record_id']} 《{field_text(fields.get('标题'))}》: "
+                  f"{old} -> {new}" + (f"，新标签 {created}" if created else ''))
+            if diff_file:
+                diff_file.write(json.dumps({
+                    'record_id': record['record_id'],
+                    'title': field_text(fields.get('标题')),
+                    'old': old,
+                    'new': new,
+                    'created': created,
+                }, ensure_ascii=False) + '\n')
+            changes.append({'record_id': record['record_id'], 'fields': {**fields, '分类': new}})
+        return changes
+
+    def _write(self, changes: List[Dict]):
+        with self.vocabulary.writing([t for c in changes for t in c['fields']['分类']]):
+            result = self.table.batch_update_records(
+                [{'record_id': c['record_id'], 'fields': {'分类': c['fields']['分类']}}
+                 for c in changes]
+            )
+        if result['errors']:
+            failed = {e['record']['record_id'] for e in result['errors']}
+            changes = [c for c in changes if c['record_id'] not in failed]
+            with self._stats_lock:
+                self.stats['errors'] += len(failed)
+        if self.mirror is not None:
+            self.mirror.upsert_records(changes)
+        if self.search_index is not None:
+            self.search_index.apply_changes(changes, [])
+        self.stats['written'] += len(changes)
+
+    def run(self, restart: bool = False, limit: int = None, diff_path: str = None) -> Dict:
+        """
+        执行重新打标签
+        :param restart: 忽略断点，从头开始
+        :param limit: 处理的记录数达到该值后在当前页结束时停止
+        :param diff_path: 差异写入的 JSONL 文件，可选
+        :return: 统计信息和吞吐量
+        """
+        self.options = self.vocabulary.names()
+        self._vocabulary_version = hashlib.sha1(
+            '\n'.join(sorted(self.options)).encode('utf-8')).hexdigest()
+
+        checkpoint = None if restart else self.store.load_checkpoint(self.name)
+        page_token = checkpoint['page_token'] if checkpoint else None
+        if checkpoint:
+            self.stats['scanned'] = checkpoint['scanned']
+            self.stats['changed'] = checkpoint['changed']
+            print(f"从断点继续，已处理 {checkpoint['scanned']} 条")
+
+        start = time.time()
+        scanned_at_start = self.stats['scanned']
+        diff_file = open(diff_path, 'a', encoding='utf-8') if diff_path else None
+        finished = False
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                for page in self.table.iter_pages(self.view_id, 100, page_token):
+                    records = page.get('items') or []
+                    changes = self._process_page(records, executor, diff_file)
+                    if changes and not self.dry_run:
+                        self._write(changes)
+                    self.stats['scanned'] += len(records)
+                    self.stats['changed'] += len(changes)
+
+                    next_token = page.get('page_token') if page.get('has_more') else None
+                    if next_token:
+                        self.store.save_checkpoint(self.name, next_token,
+                                                   self.stats['scanned'], self.stats['changed'])
+                    else:
+                        finished = True
+
+                    elapsed = time.time() - start
+                    print(f"已处理 {self.stats['scanned']} 条，变更 {self.stats['changed']} 条，"
+                          f"模型调用 {self.stats['llm_calls']} 次，缓存命中 {self.stats['cache_hits']} 次，"
+                          f"{(self.stats['scanned'] - scanned_at_start) / max(elapsed, 1e-6):.1f} 条/秒")
+                    if limit and self.stats['scanned'] - scanned_at_start >= limit:
+                        break
+        finally:
+            if diff_file:
+                diff_file.close()
+
+        if finished:
+            self.store.clear_checkpoint(self.name)
+        elapsed = time.time() - start
+        return {
+            **self.stats,
+            'finished': finished,
+            'elapsed': round(elapsed, 1),
+            'records_per_second': round((self.stats['scanned'] - scanned_at_start) / max(elapsed, 1e-6), 2),
+        }
+
+
+# 按当前标签词表重新打标签
+# python -m utils.retag --dry-run --diff retag.jsonl
+# python -m utils.retag --concurrency 8
+if __name__ == '__main__':
+    import argparse
+
+    from utils.feishu_table import FeishuTable
+    from utils.record_mirror import RecordMirror
+    from utils.search_index import SearchIndex
+    from utils.prompt_compactor import KeywordIndex
+    from utils.shared_state import create_shared_state
+    from utils.tag_vocabulary import TagVocabulary
+
+    parser = argparse.ArgumentParser(description='按当前标签词表重新为已有记录打标签')
+    parser.add_argument('--dry-run', action='store_true', help='只输出差异，不写回飞书')
+    parser.add_argument('--diff', help='差异写入的 JSONL 文件')
+    parser.add_argument('--restart', action='store_true', help='忽略断点，从头开始')
+    parser.add_argument('--limit', type=int, help='本次最多处理的记录数')
+    parser.add_argument('--concurrency', type=int, default=4, help='同时调用模型的数量')
+    parser.add_argument('--source', choices=['page', 'meta'], default='page',
+                        help='page 抓取网页正文，meta 只使用标题和描述')
+    parser.add_argument('--keep-existing', action='store_true', help='保留原有标签，只追加')
+    parser.add_argument('--model', default='gpt-4.1')
+    args = parser.parse_args()
+
+    state = create_shared_state(config.STATE_URL, config.DB_PATH)
+    feishu = FeishuTable('G1rDbcKyNaL1bAso3l8cImdYntX', 'tblpA7YT2FsTls21', state=state)
+    job = RetagJob(
+        feishu,
+        TagVocabulary(feishu, 'vewNTuIRsZ', '分类', state=state),
+        RetagStore(config.DB_PATH),
+        mirror=RecordMirror(config.DB_PATH, feishu),
+        search_index=SearchIndex(config.DB_PATH),
+        keyword_index=KeywordIndex(config.DB_PATH),
+        source=args.source,
+        concurrency=args.concurrency,
+        keep_existing=args.keep_existing,
+        dry_run=args.dry_run,
+        model=args.model,
+    )
+    print(job.run(args.restart, args.limit, args.diff))
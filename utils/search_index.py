@@ -0,0 +1,321 @@
+import json
+import re
+import time
+from typing import Dict, List, Iterable
+
+from utils.sqlite_store import SQLiteStore
+from utils.record_mirror import field_text, field_options
+
+_CJK_CHARS = '぀-ヿ㐀-䶿一-鿿豈-﫿가-힯'
+_CJK_RUN = re.compile(f'[{_CJK_CHARS}]+')
+_TOKEN = re.compile(r'\w+')
+
+# 正文只索引前面一部分，控制索引体积
+MAX_BODY_CHARS = 20000
+
+
+def _bigrams(match) -> str:
+    run = match.group(0)
+    if len(run) == 1:
+        return f' {run} '
+    return ' ' + ' '.join(run[i:i + 2] for i in range(len(run) - 1)) + ' '
+
+
+def segment(text: str) -> str:
+    """
+    将连续的中日韩字符切分为重叠的二元组，配合 unicode61 分词器使用
+    查询时把二元组作为短语匹配，等价于子串匹配
+    """
+    return _CJK_RUN.sub(_bigrams, text or '')
+
+
+def unique_chars(*texts: str) -> str:
+    """
+    文本中出现过的中日韩字符，去重后以空格分隔，写入单字列
+    二元组只能按前缀匹配单个汉字，且匹配不到连续汉字末尾的那个字
+    """
+    chars = dict.fromkeys(c for text in texts for run in _CJK_RUN.findall(text or '')
+                          for c in run)
+    return ' '.join(chars)
+
+
+def _single_char(term: str) -> str:
+    """
+    搜索词切分后只有一个中日韩字符时返回该字符，否则返回空字符串
+    """
+    tokens = _TOKEN.findall(segment(term))
+    if len(tokens) == 1 and len(tokens[0]) == 1 and _CJK_RUN.match(tokens[0]):
+        return tokens[0]
+    return ''
+
+
+def build_match_query(query: str) -> str:
+    """
+    将用户输入转换为 FTS5 查询，空格分隔的每个词都必须出现
+    单个汉字在单字列中精确匹配
+    """
+    phrases = []
+    for term in query.split():
+        char = _single_char(term)
+        if char:
+            phrases.append(f'chars : "{char}"')
+            continue
+        tokens = _TOKEN.findall(segment(term))
+        if tokens:
+            phrases.append('"{}"'.format(' '.join(tokens)))
+    return ' AND '.join(phrases)
+
+
+_FTS_TABLE = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+        title, description, tags, body, chars,
+        tokenize = 'unicode61 remove_diacritics 2'
+    );
+'''
+
+
+class SearchIndex(SQLiteStore):
+    """
+    已保存文章的本地全文索引
+    基于 SQLite FTS5，索引标题、描述、标签和正文，支持标签分面和 bm25 排序
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS articles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        record_id TEXT NOT NULL UNIQUE,
+        url TEXT,
+        title TEXT,
+        description TEXT,
+        tags TEXT,
+        indexed_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS article_tags (
+        article_id INTEGER NOT NULL,
+        tag TEXT NOT NULL,
+        PRIMARY KEY (article_id, tag)
+    );
+    CREATE INDEX IF NOT EXISTS idx_article_tags_tag ON article_tags(tag, article_id);
+    ''' + _FTS_TABLE
+
+    # bm25 列权重: 标题、描述、标签、正文、单字
+    weights = (10.0, 4.0, 6.0, 1.0, 1.0)
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self._add_chars_column()
+
+    def _add_chars_column(self):
+        # 旧版本的全文索引没有单字列，重建索引表并从原有内容生成
+        with self.transaction() as conn:
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(articles_fts)')}
+            if 'chars' in columns:
+                return
+            print('为全文索引添加单字列')
+            conn.create_function('unique_chars', 4, unique_chars)
+            conn.execute('ALTER TABLE articles_fts RENAME TO articles_fts_old')
+            conn.execute(_FTS_TABLE)
+            conn.execute(
+                'INSERT INTO articles_fts (rowid, title, description, tags, body, chars) '
+                'SELECT rowid, title, description, tags, body, '
+                'unique_chars(title, description, tags, body) FROM articles_fts_old'
+            )
+            conn.execute('DROP TABLE articles_fts_old')
+
+    def _write(self, conn, record_id: str, url: str, title: str,
+               description: str, tags: List[str], body: str = None):
+        rows = conn.execute('SELECT id FROM articles WHERE record_id = ?',
+                            (record_id,)).fetchall()
+        if rows:
+            article_id = rows[0]['id']
+            if body is None:
+                # 保留已有正文，只更新元数据
+                old = conn.execute('SELECT body FROM articles_fts WHERE rowid = ?',
+                                   (article_id,)).fetchall()
+                body_segmented = old[0]['body'] if old else ''
+            else:
+                body_segmented = segment(body[:MAX_BODY_CHARS])
+            conn.execute(
+                'UPDATE articles SET url = ?, title = ?, description = ?, '
+                'tags = ?, indexed_at = ? WHERE id = ?',
+                (url, title, description, json.dumps(tags, ensure_ascii=False),
+                 time.time(), article_id)
+            )
+            conn.execute('DELETE FROM articles_fts WHERE rowid = ?', (article_id,))
+            conn.execute('DELETE FROM article_tags WHERE article_id = ?', (article_id,))
+        else:
+            article_id = conn.execute(
+                'INSERT INTO articles (record_id, url, title, description, tags, indexed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (record_id, url, title, description,
+                 json.dumps(tags, ensure_ascii=False), time.time())
+            ).lastrowid
+            body_segmented = segment((body or '')[:MAX_BODY_CHARS])
+
+        conn.execute(
+            'INSERT INTO articles_fts (rowid, title, description, tags, body, chars) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (article_id, segment(title), segment(description), segment(' '.join(tags)),
+             body_segmented, unique_chars(title, description, ' '.join(tags), body_segmented))
+        )
+        conn.executemany(
+            'INSERT OR IGNORE INTO article_tags (article_id, tag) VALUES (?, ?)',
+            [(article_id, t) for t in tags if t]
+        )
+
+    def add_article(self, record_id: str, url: str, title: str,
+                    description: str, tags: List[str], body: str = None):
+        """
+        添加或更新一篇文章
+        :param record_id: 飞书记录ID
+        :param url: 文章链接
+        :param title: 标题
+        :param description: 描述
+        :param tags: 分类标签
+        :param body: 正文文本，为None时保留已索引的正文
+        """
+        with self.transaction() as conn:
+            self._write(conn, record_id, url, title or '', description or '',
+                        tags or [], body)
+
+    def apply_changes(self, records: Iterable[Dict], removed: Iterable[str]):
+        """
+        同步镜像中的修改，作为 RecordMirror.sync 的监听函数
+        :param records: 新增或修改的飞书记录
+        :param removed: 已删除的记录ID
+        """
+        with self.transaction() as conn:
+            for record in records:
+                fields = record.get('fields', {})
+                self._write(conn, record['record_id'],
+                            field_text(fields.get('链接')),
+                            field_text(fields.get('标题')),
+                            field_text(fields.get('描述')),
+                            field_options(fields.get('分类')))
+            for record_id in removed:
+                rows = conn.execute('SELECT id FROM articles WHERE record_id = ?',
+                                    (record_id,)).fetchall()
+                if not rows:
+                    continue
+                article_id = rows[0]['id']
+                conn.execute('DELETE FROM articles_fts WHERE rowid = ?', (article_id,))
+                conn.execute('DELETE FROM article_tags WHERE article_id = ?', (article_id,))
+                conn.execute('DELETE FROM articles WHERE id = ?', (article_id,))
+
+    def count(self) -> int:
+        return self.query('SELECT COUNT(*) FROM articles')[0][0]
+
+    def search(self, query: str = '', tags: List[str] = None,
+               limit: int = 20, offset: int = 0, facet_limit: int = 20) -> Dict:
+        """
+        全文搜索
+        :param query: 搜索词，空格分隔的多个词需同时命中
+        :param tags: 标签筛选，需同时包含全部标签
+        :param limit: 返回条数
+        :param offset: 偏移量
+        :param facet_limit: 返回的标签分面数量
+        :return: 命中总数、结果列表和标签分面
+        """
+        start = time.perf_counter()
+        match = build_match_query(query or '')
+        tags = [t for t in (tags or []) if t]
+
+        # 只有单个汉字时各篇文章的相关度没有区别，按保存时间倒序，不用为全部命中计算 bm25
+        ranked = any(not _single_char(term) for term in (query or '').split())
+
+        # 标签筛选使用相关子查询，命中 article_tags 主键索引
+        def tag_filter(column, tags):
+            return ''.join(
+                ' AND EXISTS (SELECT 1 FROM article_tags t '
+                f'WHERE t.article_id = {column} AND t.tag = ?)'
+                for _ in tags
+            )
+
+        # 命中的文章ID，只读全文索引或标签索引，统计总数和分面时不用回表
+        if match:
+            ids = 'SELECT f.rowid AS id FROM articles_fts f WHERE articles_fts MATCH ?' \
+                  + tag_filter('f.rowid', tags)
+            params = (match, *tags)
+        elif tags:
+            # 只按标签筛选时从标签索引读取，不用扫描全部文章
+            ids = 'SELECT t0.article_id AS id FROM article_tags t0 WHERE t0.tag = ?' \
+                  + tag_filter('t0.article_id', tags[1:])
+            params = tuple(tags)
+        else:
+            ids = 'SELECT a.id FROM articles a'
+            params = ()
+
+        if match and ranked:
+            rows = self.query(
+                'SELECT a.record_id, a.url, a.title, a.description, a.tags, '
+                'bm25(articles_fts, ?, ?, ?, ?, ?) AS score '
+                'FROM articles_fts f JOIN articles a ON a.id = f.rowid '
+                f'WHERE articles_fts MATCH ?{tag_filter("a.id", tags)} '
+                'ORDER BY score LIMIT ? OFFSET ?',
+                (*self.weights, *params, limit, offset)
+            )
+        else:
+            rows = self.query(
+                'SELECT a.record_id, a.url, a.title, a.description, a.tags, 0 AS score '
+                f'FROM ({ids} ORDER BY id DESC LIMIT ? OFFSET ?) m '
+                'JOIN articles a ON a.id = m.id ORDER BY m.id DESC',
+                (*params, limit, offset)
+            )
+
+        total = self.query(f'SELECT COUNT(*) FROM ({ids})', params)[0][0]
+        # 没有任何筛选时直接按标签索引统计
+        source = f'({ids}) m JOIN article_tags t ON t.article_id = m.id' \
+            if params else 'article_tags t'
+        facets = self.query(
+            f'SELECT t.tag, COUNT(*) AS n FROM {source} '
+            'GROUP BY t.tag ORDER BY n DESC LIMIT ?',
+            (*params, facet_limit)
+        )
+
+        return {
+            'total': total,
+            'items': [
+                {
+                    'record_id': row['record_id'],
+                    'url': row['url'],
+                    'title': row['title'],
+                    'description': row['description'],
+                    'tags': json.loads(row['tags'] or '[]'),
+                    'score': row['score'],
+                }
+                for row in rows
+            ],
+            'facets': [{'tag': row['tag'], 'count': row['n']} for row in facets],
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3),
+        }
+
+
+# 性能测试：python -m utils.search_index [文章数]
+if __name__ == "__main__":
+    import os
+    import random
+    import sys
+    import tempfile
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    random.seed(0)
+    chars = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+    words = [''.join(random.sample(chars, random.randint(2, 4))) for _ in range(20000)]
+    words += ['Python', 'Rust', 'Docker', 'Redis', 'Kubernetes', 'FastAPI']
+    all_tags = ['AI', '编程', '工具', '架构', '数据', '运维', '产品', '设计']
+
+    path = os.path.join(tempfile.mkdtemp(), 'search.db')
+    index = SearchIndex(path)
+    t0 = time.time()
+    with index.transaction() as conn:
+        for i in range(n):
+            body = '，'.join(random.choice(words) for _ in range(300))
+            index._write(conn, f'rec{i}', f'https://example.com/{i}',
+                         f'{random.choice(words)}实践 {i}', random.choice(words),
+                         random.sample(all_tags, 2), body)
+    print(f'写入 {n} 篇文章耗时 {time.time() - t0:.1f}s')
+
+    queries = [(words[0], None), (f'{words[1]} {words[2]}', None),
+               ('Rust', ['AI']), (words[3][:1], None), ('', ['工具'])]
+    for q, t in queries:
+        cost = min(index.search(q, t)['elapsed_ms'] for _ in range(5))
+        print(f'查询 {q!r} 标签 {t}: {cost:.2f} ms')
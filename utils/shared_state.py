@@ -0,0 +1,195 @@
+import json
+import os
+import socket
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from utils.sqlite_store import SQLiteStore
+
+_worker_ids = {}
+
+
+def worker_id() -> str:
+    """
+    当前进程的唯一标识，用作租约持有者，fork 出的子进程会得到新的标识
+    """
+    pid = os.getpid()
+    if pid not in _worker_ids:
+        _worker_ids[pid] = f'{socket.gethostname()}-{pid}-{uuid.uuid4().hex[:6]}'
+    return _worker_ids[pid]
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class SharedState(ABC):
+    """
+    跨进程共享状态接口
+    多个 uvicorn worker 通过它共享令牌、游标，并通过租约选出唯一执行后台任务的进程
+    """
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float = None):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """
+        获取或续期租约
+        :param name: 租约名称
+        :param owner: 持有者标识
+        :param ttl: 有效期（秒），持有者需在过期前续期
+        :return: 是否持有租约
+        """
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        pass
+
+    def is_leader(self, name: str, ttl: float) -> bool:
+        """
+        当前进程是否为指定后台任务的 leader，调用即续期
+        """
+        return self.acquire_lease(f'leader:{name}', worker_id(), ttl)
+
+    @contextmanager
+    def lock(self, name: str, timeout: float = 30, ttl: float = 60):
+        """
+        跨进程互斥锁，持有者崩溃后 ttl 秒自动释放
+        :param name: 锁名称
+        :param timeout: 等待获取锁的最长时间（秒）
+        :param ttl: 锁的最长持有时间（秒）
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        delay = 0.01
+        while not self.acquire_lease(f'lock:{name}', owner, ttl):
+            if time.time() > deadline:
+                raise LockTimeout(f'获取锁超时: {name}')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+        try:
+            yield
+        finally:
+            self.release_lease(f'lock:{name}', owner)
+
+
+class SQLiteSharedState(SQLiteStore, SharedState):
+    """
+    基于 SQLite 文件的共享状态，适用于单机多进程
+    """
+    schema = '''
+    CREATE TABLE IF NOT EXISTS shared_state (
+        key TEXT PRIMARY KEY,
+        value TEXT,
+        expires_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    '''
+
+    def get(self, key: str, default: Any = None) -> Any:
+        rows = self.query(
+            'SELECT value FROM shared_state WHERE key = ? '
+            'AND (expires_at IS NULL OR expires_at > ?)', (key, time.time())
+        )
+        return json.loads(rows[0]['value']) if rows else default
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        self.execute(
+            'INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value, ensure_ascii=False),
+             time.time() + ttl if ttl else None)
+        )
+
+    def delete(self, key: str):
+        self.execute('DELETE FROM shared_state WHERE key = ?', (key,))
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self.transaction() as conn:
+            rows = conn.execute('SELECT owner, expires_at FROM leases WHERE name = ?',
+                                (name,)).fetchall()
+            if rows and rows[0]['owner'] != owner and rows[0]['expires_at'] > now:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)',
+                (name, owner, now + ttl)
+            )
+            return True
+
+    def release_lease(self, name: str, owner: str):
+        self.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+
+
+class RedisSharedState(SharedState):
+    """
+    基于 Redis 的共享状态，适用于多机部署，需要安装 redis
+    """
+    _renew_script = '''
+    local current = redis.call('GET', KEYS[1])
+    if current == false or current == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        return 1
+    end
+    return 0
+    '''
+    _release_script = '''
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    '''
+
+    def __init__(self, url: str, prefix: str = 'webpage_collect:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._renew = self.client.register_script(self._renew_script)
+        self._release = self.client.register_script(self._release_script)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else default
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False),
+                        px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        return bool(self._renew(keys=[self.prefix + name], args=[owner, int(ttl * 1000)]))
+
+    def release_lease(self, name: str, owner: str):
+        self._release(keys=[self.prefix + name], args=[owner])
+
+
+def create_shared_state(url: Optional[str], default_path: str) -> SharedState:
+    """
+    根据配置创建共享状态后端
+    :param url: redis://... 使用 Redis，sqlite:///路径 或为空时使用 SQLite
+    :param default_path: 未指定时使用的 SQLite 文件路径
+    """
+    if url and url.startswith(('redis://', 'rediss://')):
+        return RedisSharedState(url)
+    if url and url.startswith('sqlite:///'):
+        return SQLiteSharedState(url[len('sqlite:///'):])
+    return SQLiteSharedState(default_path)
@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List
+
+
+class SQLiteStore:
+    """
+    本地 SQLite 存储基类
+    使用 WAL 模式，多个线程共享同一个连接，写操作通过锁串行化
+    """
+    schema = ''
+
+    def __init__(self, db_path: str):
+        """
+        初始化存储并建表
+        :param db_path: 数据库文件路径
+        """
+        dirname = os.path.dirname(db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, timeout=30,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        if self.schema:
+            with self._lock:
+                self._conn.executescript(self.schema)
+
+    def ensure_column(self, table: str, column: str, definition: str):
+        """
+        为旧版本建立的表补充新增的列
+        :param definition: 列定义，如 "TEXT NOT NULL DEFAULT ''"
+        """
+        # 多个进程同时启动时，检查和添加在同一个写事务中完成，不会重复添加
+        with self.transaction() as conn:
+            columns = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+    @contextmanager
+    def transaction(self):
+        """
+        开启写事务，退出时提交，异常时回滚
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            else:
+                self._conn.execute('COMMIT')
+
+    def query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        """
+        执行查询并返回全部结果
+        """
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params=()) -> int:
+        """
+        执行单条写语句
+        :return: 影响的行数
+        """
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
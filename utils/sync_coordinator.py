@@ -0,0 +1,147 @@
+import asyncio
+import contextvars
+import time
+from typing import Callable, Dict, List, Optional
+
+from utils.tracing import span
+
+# 旧版本所有客服账号共用的游标
+LEGACY_CURSOR_KEY = 'kf_cursor'
+
+
+class _Account:
+    def __init__(self):
+        self.token = ''
+        self.pending = False
+        self.task: Optional[asyncio.Task] = None
+        self.failures = 0
+        self.last_sync_at = 0
+        self.last_count = 0
+        self.syncs = 0
+        self.notifications = 0
+
+
+class SyncCoordinator:
+    """
+    按客服账号拉取消息
+    每个 open_kfid 一个同步循环，不同账号互不等待；同一账号在同步期间收到的回调
+    合并为一次待同步，同步结束后再拉取一轮，而不是每个回调各调用一次 sync_msg。
+    游标按账号保存在共享状态中，每拉取一页加一次跨进程锁，多个进程不会拉取到同一批消息
+    """
+
+    def __init__(self, fetch: Callable[[str, str, str], Dict],
+                 handle: Callable[[str, List[Dict]], None], state,
+                 on_synced: Callable[[str, int], None] = None,
+                 max_failures: int = 5, retry_delay: float = 5):
+        """
+        :param fetch: 拉取一页消息，参数为 (open_kfid, token, cursor)，返回 sync_msg 的结果
+        :param handle: 处理一页消息，参数为 (open_kfid, msg_list)，在线程中执行，返回前需要持久化
+        :param state: SharedState 实例，保存游标和跨进程锁
+        :param on_synced: 一轮同步完成后在事件循环中调用，参数为 (open_kfid, 消息数)，可选
+        :param max_failures: 连续失败多少次后停止重试，等待下一次回调
+        :param retry_delay: 首次重试的等待时间（秒），之后每次翻倍
+        """
+        self.fetch = fetch
+        self.handle = handle
+        self.state = state
+        self.on_synced = on_synced
+        self.max_failures = max_failures
+        self.retry_delay = retry_delay
+        self._accounts: Dict[str, _Account] = {}
+
+    @staticmethod
+    def cursor_key(open_kfid: str) -> str:
+        return f'kf_cursor:{open_kfid}'
+
+    def notify(self, open_kfid: str, token: str = ''):
+        """
+        收到回调，在事件循环中调用
+        账号正在同步时只标记待同步，否则启动同步循环
+        :param token: 回调中的 Token，拉取消息时使用
+        """
+        account = self._accounts.setdefault(open_kfid, _Account())
+        account.notifications += 1
+        if token:
+            account.token = token
+        account.pending = True
+        if account.task is None or account.task.done():
+            # 同步循环比触发它的回调活得久，不继承回调的链路
+            account.task = asyncio.create_task(self._run(open_kfid, account),
+                                               context=contextvars.Context())
+
+    async def _run(self, open_kfid: str, account: _Account):
+        while account.pending:
+            account.pending = False
+            try:
+                count = await asyncio.to_thread(self._sync, open_kfid, account.token)
+            except Exception as e:
+                account.failures += 1
+                print(f"客服账号 {open_kfid} 拉取消息失败（第 {account.failures} 次）: {e}")
+                if account.failures >= self.max_failures:
+                    # 不再重试，下一次回调重新开始
+                    account.failures = 0
+                    continue
+                account.pending = True
+                await asyncio.sleep(min(self.retry_delay * 2 ** (account.failures - 1), 60))
+                continue
+
+            account.failures = 0
+            account.syncs += 1
+            account.last_sync_at = time.time()
+            account.last_count = count
+            if self.on_synced is not None:
+                self.on_synced(open_kfid, count)
+
+    def _claim_legacy_cursor(self) -> str:
+        # 从旧版本升级时，第一个同步的账号沿用原来的游标
+        with self.state.lock(LEGACY_CURSOR_KEY):
+            cursor = self.state.get(LEGACY_CURSOR_KEY, '')
+            if cursor:
+                self.state.delete(LEGACY_CURSOR_KEY)
+            return cursor
+
+    def _sync(self, open_kfid: str, token: str) -> int:
+        """
+        拉取账号的全部新消息，直到 has_more 为 0
+        :return: 消息数
+        """
+        with span('wechat.sync', open_kfid=open_kfid) as sync_span:
+            count = self._sync_pages(open_kfid, token)
+            sync_span.set(messages=count)
+            return count
+
+    def _sync_pages(self, open_kfid: str, token: str) -> int:
+        key = self.cursor_key(open_kfid)
+        count = 0
+        while True:
+            with self.state.lock(key):
+                cursor = self.state.get(key)
+                if cursor is None:
+                    cursor = self._claim_legacy_cursor()
+                result = self.fetch(open_kfid, token, cursor)
+                if result.get('errcode', 0) != 0:
+                    raise Exception(f"拉取消息失败: {result}")
+                messages = result.get('msg_list', [])
+                # 消息先写入任务队列再提交游标，服务重启也不会丢失
+                self.handle(open_kfid, messages)
+                self.state.set(key, result.get('next_cursor') or cursor)
+            count += len(messages)
+            if not result.get('has_more') or not messages:
+                return count
+
+    def status(self) -> Dict[str, Dict]:
+        """
+        各账号的同步状态
+        """
+        return {
+            open_kfid: {
+                'running': account.task is not None and not account.task.done(),
+                'pending': account.pending,
+                'notifications': account.notifications,
+                'syncs': account.syncs,
+                'failures': account.failures,
+                'last_sync_at': account.last_sync_at,
+                'last_count': account.last_count,
+            }
+            for open_kfid, account in self._accounts.items()
+        }
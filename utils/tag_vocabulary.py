@@ -0,0 +1,181 @@
+import difflib
+import re
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List
+
+_STRIP_CHARS = ' #"\'“”‘’「」【】[]()（）、，,。.;；:：'
+
+
+def clean_tag(tag: str) -> str:
+    """
+    清理标签的显示形式：全角转半角、合并空白、去掉首尾标点
+    """
+    tag = unicodedata.normalize('NFKC', tag or '')
+    return re.sub(r'\s+', ' ', tag).strip(_STRIP_CHARS)
+
+
+def tag_key(tag: str) -> str:
+    """
+    标签的归一化键，忽略大小写和空白，用于判断两个标签是否相同
+    """
+    return re.sub(r'\s+', '', clean_tag(tag)).casefold()
+
+
+class TagVocabulary:
+    """
+    分类标签词表
+    在内存中维护多选字段的选项索引，将模型输出的标签归一到已有选项，
+    新标签先暂存，再合并为一次 update_field 调用批量创建
+    """
+
+    def __init__(self, table, view_id: str, field_name: str = '分类',
+                 similarity: float = 0.85, refresh_interval: float = 600,
+                 state=None):
+        """
+        :param table: FeishuTable 实例
+        :param view_id: 视图ID
+        :param field_name: 多选字段名
+        :param similarity: 模糊匹配阈值，0~1，越大越严格
+        :param refresh_interval: 从飞书重新加载选项的间隔（秒）
+        :param state: SharedState 实例，多进程部署时用于串行化选项更新，可选
+        """
+        self.table = table
+        self.view_id = view_id
+        self.field_name = field_name
+        self.similarity = similarity
+        self.refresh_interval = refresh_interval
+        self.state = state
+        self._lock = threading.RLock()
+        # 串行化 flush，避免同一进程重复创建选项
+        self._flush_lock = threading.Lock()
+        self._index: Dict[str, str] = {}
+        self._pending: Dict[str, str] = {}
+        self._loaded_at = 0
+
+    def _load_field(self) -> Dict:
+        field = self.table.get_field(self.view_id, self.field_name)
+        if not field:
+            raise Exception(f"字段 {self.field_name} 不存在")
+        return field
+
+    def _set_options(self, options: List[Dict]):
+        self._index = {tag_key(o['name']): o['name'] for o in options}
+        for key in list(self._pending):
+            if key in self._index:
+                del self._pending[key]
+        self._loaded_at = time.time()
+
+    def load(self):
+        """
+        从飞书加载字段选项
+        """
+        field = self._load_field()
+        with self._lock:
+            self._set_options(field.get('property', {}).get('options', []))
+
+    def ensure_loaded(self):
+        if time.time() - self._loaded_at > self.refresh_interval:
+            self.load()
+
+    def names(self) -> List[str]:
+        """
+        已有的选项名称，用于提示模型复用
+        """
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._index.values())
+
+    def _match(self, key: str) -> str:
+        name = self._index.get(key) or self._pending.get(key)
+        if name:
+            return name
+        close = difflib.get_close_matches(key, list(self._index), n=1, cutoff=self.similarity)
+        return self._index[close[0]] if close else ''
+
+    def resolve(self, tags: List[str]) -> List[str]:
+        """
+        将模型输出的标签归一到已有选项，未匹配的标签加入待创建列表
+        :param tags: 原始标签
+        :return: 去重后的标签名称
+        """
+        self.ensure_loaded()
+        result = []
+        with self._lock:
+            for tag in tags:
+                key = tag_key(tag)
+                if not key:
+                    continue
+                name = self._match(key)
+                if not name:
+                    name = clean_tag(tag)
+                    self._pending[key] = name
+                if name not in result:
+                    result.append(name)
+        return result
+
+    def has_pending(self, tags: List[str]) -> bool:
+        """
+        标签中是否有尚未创建的选项
+        """
+        with self._lock:
+            return any(tag_key(t) in self._pending for t in tags)
+
+    def _field_lock(self):
+        return self.state.lock(f'tag_vocabulary:{self.field_name}') \
+            if self.state is not None else nullcontext()
+
+    def _flush(self) -> int:
+        # 调用方持有 _flush_lock 和字段锁
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return 0
+
+        # 更新前重新读取字段，保留其他进程刚创建的选项
+        field = self._load_field()
+        options = field.get('property', {}).get('options', [])
+        existing = {tag_key(o['name']) for o in options}
+        new_options = [{'name': name} for key, name in pending.items()
+                       if key not in existing]
+
+        if new_options:
+            result = self.table.update_field(
+                field['field_id'], field['field_name'], field['type'],
+                field_property={'options': options + new_options}
+            )
+            options = result.get('field', {}).get('property', {}).get(
+                'options', options + new_options)
+
+        with self._lock:
+            self._set_options(options)
+            for key in pending:
+                self._pending.pop(key, None)
+        return len(new_options)
+
+    def flush(self) -> int:
+        """
+        将暂存的新标签一次性写入字段选项
+        已有选项带上原来的 id，避免表中数据被重置；
+        读写飞书时不持有词表的锁，期间 resolve 不受影响，新暂存的标签留到下一次创建
+        :return: 新建的选项数
+        """
+        with self._flush_lock, self._field_lock():
+            return self._flush()
+
+    @contextmanager
+    def writing(self, tags: List[str]):
+        """
+        写入带标签的记录
+        标签中有尚未创建的选项时，先在字段锁内批量创建，并在同一把锁内完成写入：
+        飞书写入记录时会逐个补上缺少的选项，与 flush 并发时可能被其覆盖掉
+        :param tags: 记录的全部标签
+        """
+        if not self.has_pending(tags):
+            yield
+            return
+        with self._flush_lock, self._field_lock():
+            self._flush()
+            yield
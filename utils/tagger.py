@@ -0,0 +1,141 @@
+import threading
+import time
+from typing import List
+
+import config
+from utils.tracing import traced, current_span
+from utils.llm_usage import record_usage
+
+_client = None
+_client_lock = threading.Lock()
+
+PROMPT_TEMPLATE = '''
+    # 角色
+    你是一个高效的分类标签生成助手，能精准分析文本内容，为其生成合适的分类标签，方便在文章库中进行过滤。若文章介绍了某个软件或者工具，会将该软件/工具名称也作为一个标签。
+
+    ## 技能
+    ### 技能 1: 生成分类标签
+    1. 仔细分析用户提供的文本内容。
+    2. 根据内容主题、关键信息等，生成不超过4个分类标签，每个标签不超过4个字。
+    3. 若文本介绍了软件或工具，将该软件/工具名称也作为一个标签。
+    4. 用英文逗号分隔标签进行输出。
+
+    ## 限制:
+    - 只专注于生成文本分类标签相关内容，拒绝回答无关话题。
+    - 输出的标签必须符合要求，不超过规定数量和字数。
+    - 输出格式必须是英文逗号分隔的标签形式。
+    - 只需输出标签，不要包含其他内容。
+    - 如果在已有标签中有相近的，就使用已有标签。
+    
+    ## 已有标签:
+    {}
+
+    具体内容如下：\n\n
+    {}
+    '''
+
+
+def build_prompt(text: str, tags: List[str]) -> str:
+    """
+    生成打标签的提示词
+    :param text: 文章内容，可以是完整正文或压缩后的文档
+    :param tags: 已有标签
+    """
+    return PROMPT_TEMPLATE.format('\n'.join(f'- {o}' for o in tags), text)
+
+
+def get_client():
+    """
+    共享的 OpenAI 客户端，首次使用时才导入 openai，并复用连接池
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            # 默认超时长达 10 分钟，重试全部用完也要在任务的可见性超时之前结束
+            timeout = min(config.OPENAI_TIMEOUT,
+                          config.JOB_VISIBILITY_TIMEOUT / (config.OPENAI_MAX_RETRIES + 2))
+            _client = OpenAI(
+                base_url=config.OPENAI_API_BASE,
+                api_key=config.OPENAI_API_KEY,
+                timeout=timeout,
+                max_retries=config.OPENAI_MAX_RETRIES
+            )
+        return _client
+
+
+def create_response(prompt: str, model: str):
+    """
+    调用模型并记录用量，成功和失败都计入 llm_usage
+    :param prompt: 提示词
+    :param model: 模型名称
+    :return: 模型的响应
+    """
+    start = time.perf_counter()
+    try:
+        response = get_client().responses.create(model=model, input=prompt)
+    except Exception as e:
+        record_usage(model, time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+        raise
+    record_usage(model, time.perf_counter() - start, response.usage)
+    return response
+
+
+@traced('llm')
+def gen_tags(text: str, tags: List[str], model: str = "gpt-4.1") -> List[str]:
+    """
+    调用模型生成分类标签
+    :param text: 文章内容
+    :param tags: 已有标签
+    :param model: 模型名称
+    :return: 标签列表
+    """
+    response = create_response(build_prompt(text, tags), model)
+    current_span().set(model=model, input_tokens=getattr(response.usage, 'input_tokens', None))
+    return response.output_text.split(',')
+
+
+# 对比完整提示词和压缩提示词的 token 数、耗时和标签一致性
+# python -m utils.tagger 链接1 链接2 ...
+if __name__ == "__main__":
+    import sys
+    from utils.extractor import fetch_page, parse_page
+    from utils.feishu_table import FeishuTable
+    from utils.llm_usage import usage_scope
+    from utils.prompt_compactor import KeywordIndex, compact_document, relevant_tags
+    from utils.tag_vocabulary import tag_key
+
+    feishu = FeishuTable('G1rDbcKyNaL1bAso3l8cImdYntX', 'tblpA7YT2FsTls21')
+    field = feishu.get_field('vewNTuIRsZ', '分类')
+    options = [o["name"] for o in field["property"]["options"]]
+    keyword_index = KeywordIndex(config.DB_PATH)
+
+    def run(prompt):
+        start = time.perf_counter()
+        # 对比测试的调用同样计入模型用量
+        with usage_scope(purpose='prompt_benchmark'):
+            response = create_response(prompt, "gpt-4.1")
+        return (response.output_text.split(','), response.usage.input_tokens,
+                time.perf_counter() - start)
+
+    rows = []
+    for url in sys.argv[1:]:
+        article = parse_page(*fetch_page(url))
+        doc = compact_document(article, keywords=keyword_index.top_keywords(article['text']))
+        full_tags, full_tokens, full_latency = run(build_prompt(article['text'], options))
+        compact_tags, compact_tokens, compact_latency = run(
+            build_prompt(doc, relevant_tags(doc, options)))
+
+        a = {tag_key(t) for t in full_tags}
+        b = {tag_key(t) for t in compact_tags}
+        agreement = len(a & b) / len(a | b) if a | b else 1.0
+        rows.append((full_tokens, compact_tokens, full_latency, compact_latency, agreement))
+        print(f"{url}\n  完整: {full_tokens} tokens {full_latency:.2f}s {full_tags}"
+              f"\n  压缩: {compact_tokens} tokens {compact_latency:.2f}s {compact_tags}"
+              f"\n  标签一致性: {agreement:.2f}")
+
+    if rows:
+        n = len(rows)
+        print(f"\n平均 tokens: {sum(r[0] for r in rows) / n:.0f} -> {sum(r[1] for r in rows) / n:.0f}")
+        print(f"平均耗时: {sum(r[2] for r in rows) / n:.2f}s -> {sum(r[3] for r in rows) / n:.2f}s")
+        print(f"平均标签一致性: {sum(r[4] for r in rows) / n:.2f}")
@@ -0,0 +1,280 @@
+import asyncio
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import config
+
+_current = contextvars.ContextVar('current_span', default=None)
+_profiling = threading.local()
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'start', 'duration_ms',
+                 'attributes', 'error')
+
+    def __init__(self, trace: '_Trace', name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration_ms = None
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        """
+        补充属性，如任务结果、token 数
+        """
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration_ms': self.duration_ms,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _Trace:
+    def __init__(self, sampled: bool, memory: bool):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.sampled = sampled
+        self.memory = memory
+        self.profiles: List[cProfile.Profile] = []
+        self.lock = threading.Lock()
+
+
+class Tracer:
+    """
+    轻量的链路追踪
+    span 通过 contextvars 传递，asyncio.to_thread 启动的线程会继承当前 span；
+    完成的链路保存在内存环形缓冲区中，可选同时追加写入 JSONL 文件。
+    可以按需对接下来的 N 条链路采样 cProfile 和 tracemalloc，结果写入磁盘
+    """
+
+    def __init__(self, buffer_size: int = 200, export_path: str = None,
+                 profile_dir: str = 'data/profiles'):
+        """
+        :param buffer_size: 内存中保留的链路数
+        :param export_path: JSONL 文件路径，为空时只保存在内存中
+        :param profile_dir: 采样结果目录
+        """
+        self.traces = deque(maxlen=buffer_size)
+        self.export_path = export_path
+        self.profile_dir = profile_dir
+        self._lock = threading.Lock()
+        self._profile_remaining = 0
+        self._profile_memory = False
+        self._profile_name = None
+        self._memory_traces = 0
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        记录一段操作的耗时，没有上级 span 时开始一条新的链路
+        在工作线程中执行的 span 会在链路被采样时记录 cProfile
+        """
+        parent = _current.get()
+        if parent is None:
+            sampled, memory = self._take_sample(name)
+            trace = _Trace(sampled, memory)
+            if memory:
+                self._start_memory()
+        else:
+            trace = parent.trace
+        span = Span(trace, name, parent.span_id if parent else None, attributes)
+        token = _current.set(span)
+        profile = self._start_profile(trace)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+                _profiling.active = False
+                with trace.lock:
+                    trace.profiles.append(profile)
+            span.duration_ms = round((time.time() - span.start) * 1000, 2)
+            _current.reset(token)
+            with trace.lock:
+                trace.spans.append(span)
+            if parent is None:
+                self._finish(trace, span)
+
+    def traced(self, name: str = None, root: bool = True):
+        """
+        为函数添加 span 的装饰器
+        :param root: 没有上级 span 时是否开始新的链路，后台循环频繁调用的函数设为 False，
+                     避免大量只有一个 span 的链路挤掉环形缓冲区中的任务链路
+        """
+        def decorator(func):
+            span_name = name or func.__name__
+
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if not root and _current.get() is None:
+                        return await func(*args, **kwargs)
+                    with self.span(span_name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not root and _current.get() is None:
+                    return func(*args, **kwargs)
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish(self, trace: _Trace, root: Span):
+        with trace.lock:
+            spans = sorted(trace.spans, key=lambda s: s.start)
+        record = {
+            'trace_id': trace.trace_id,
+            'name': root.name,
+            'start': root.start,
+            'duration_ms': root.duration_ms,
+            'error': root.error,
+            'spans': [s.to_dict() for s in spans],
+        }
+        if trace.sampled:
+            record['profiles'] = self._dump_profiles(trace, root)
+        with self._lock:
+            self.traces.append(record)
+        if self.export_path:
+            try:
+                with open(self.export_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            except OSError as e:
+                print(f"写入链路追踪文件失败: {e}")
+
+    def recent(self, limit: int = 50, min_ms: float = 0, name: str = None) -> List[Dict]:
+        """
+        最近完成的链路，按时间倒序
+        :param min_ms: 只返回耗时不少于该值的链路
+        :param name: 只返回指定根 span 名称的链路
+        """
+        with self._lock:
+            traces = list(self.traces)
+        result = []
+        for trace in reversed(traces):
+            if trace['duration_ms'] >= min_ms and (not name or trace['name'] == name):
+                result.append(trace)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def get(self, trace_id: str) -> Optional[Dict]:
+        with self._lock:
+            for trace in self.traces:
+                if trace['trace_id'] == trace_id:
+                    return trace
+        return None
+
+    def start_profiling(self, count: int, memory: bool = False, name: str = None):
+        """
+        对接下来开始的 count 条链路采样
+        :param memory: 是否同时记录 tracemalloc，并发执行的链路会互相计入
+        :param name: 只采样指定根 span 名称的链路，如 job
+        """
+        with self._lock:
+            self._profile_remaining = count
+            self._profile_memory = memory
+            self._profile_name = name
+
+    def profiling_status(self) -> Dict:
+        files = []
+        if os.path.isdir(self.profile_dir):
+            files = sorted(os.listdir(self.profile_dir), reverse=True)[:50]
+        return {
+            'remaining': self._profile_remaining,
+            'memory': self._profile_memory,
+            'name': self._profile_name,
+            'profile_dir': self.profile_dir,
+            'files': files,
+        }
+
+    def _take_sample(self, name: str):
+        with self._lock:
+            if self._profile_remaining <= 0 or self._profile_name not in (None, name):
+                return False, False
+            self._profile_remaining -= 1
+            return True, self._profile_memory
+
+    def _start_profile(self, trace: _Trace) -> Optional[cProfile.Profile]:
+        # cProfile 只能记录当前线程；事件循环线程中同时运行着其他请求，不记录
+        if not trace.sampled or getattr(_profiling, 'active', False):
+            return None
+        try:
+            asyncio.get_running_loop()
+            return None
+        except RuntimeError:
+            pass
+        profile = cProfile.Profile()
+        _profiling.active = True
+        profile.enable()
+        return profile
+
+    def _start_memory(self):
+        with self._lock:
+            self._memory_traces += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+
+    def _dump_profiles(self, trace: _Trace, root: Span) -> List[str]:
+        os.makedirs(self.profile_dir, exist_ok=True)
+        prefix = os.path.join(
+            self.profile_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(root.start))}-{root.name}-{trace.trace_id[:8]}"
+        )
+        files = []
+        with trace.lock:
+            profiles = list(trace.profiles)
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(prefix + '.prof')
+            files.append(prefix + '.prof')
+
+        if trace.memory:
+            snapshot = tracemalloc.take_snapshot()
+            with self._lock:
+                self._memory_traces -= 1
+                if self._memory_traces <= 0:
+                    tracemalloc.stop()
+            with open(prefix + '.memory.txt', 'w', encoding='utf-8') as f:
+                for stat in snapshot.statistics('lineno')[:50]:
+                    f.write(f"{stat}\n")
+            files.append(prefix + '.memory.txt')
+        return files
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+tracer = Tracer(config.TRACE_BUFFER, config.TRACE_FILE, config.PROFILE_DIR)
+span = tracer.span
+traced = tracer.traced
@@ -1,16 +1,19 @@
-from lxml import etree
-from typing import Dict, Optional
+from typing import Dict, Optional, Union
 import time
 
-def parse_xml(xml_string: str) -> Optional[Dict]:
+def parse_xml(xml_string: Union[str, bytes]) -> Optional[Dict]:
     """
     解析微信XML消息为字典
-    :param xml_string: XML字符串
+    :param xml_string: XML字符串，也可以直接传入字节，省去编解码
     :return: 解析后的字典
     """
+    from lxml import etree
+
     try:
         # print(f"开始解析XML: {xml_string}")
-        root = etree.fromstring(xml_string.encode('utf-8'))
+        if isinstance(xml_string, str):
+            xml_string = xml_string.encode('utf-8')
+        root = etree.fromstring(xml_string)
         result = {}
         for child in root:
             result[child.tag] = child.text